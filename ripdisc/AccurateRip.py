@@ -0,0 +1,84 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import zlib
+import numpy
+
+# AccurateRip v1/v2 and CRC32 of a track, computed while it is ripped
+class TrackChecksum():
+	SAMPLES_PER_SECTOR = 588
+	_SKIP_SAMPLES = 5 * SAMPLES_PER_SECTOR
+
+	def __init__(self, sample_count, first_track = False, last_track = False):
+		self._sample_count = sample_count
+		# AccurateRip ignores the first and last five sectors of the disc,
+		# as drive offsets make them unreliable. Multipliers are 1-based.
+		self._check_start = self._SKIP_SAMPLES if first_track else 1
+		self._check_end = (sample_count - self._SKIP_SAMPLES) if last_track else sample_count
+		self._position = 0
+		self._pending = b""
+		self._crc32 = 0
+		self._sum_lo = 0
+		self._sum_hi = 0
+
+	@property
+	def complete(self):
+		return self._position >= self._sample_count
+
+	@property
+	def crc32(self):
+		return self._crc32
+
+	@property
+	def accuraterip_v1(self):
+		return self._sum_lo & 0xffffffff
+
+	@property
+	def accuraterip_v2(self):
+		return (self._sum_lo + self._sum_hi) & 0xffffffff
+
+	def feed(self, data):
+		self._crc32 = zlib.crc32(data, self._crc32)
+		data = self._pending + data
+		count = len(data) // 4
+		self._pending = data[count * 4 : ]
+		if count == 0:
+			return
+
+		# One stereo sample is one little endian 32-bit word. The product
+		# with its (at most 28 bit) multiplier always fits into 64 bits.
+		samples = numpy.frombuffer(data, dtype = "<u4", count = count).astype(numpy.uint64)
+		lo_index = max(self._check_start - self._position - 1, 0)
+		hi_index = min(self._check_end - self._position, count)
+		if hi_index > lo_index:
+			multipliers = numpy.arange(self._position + lo_index + 1, self._position + hi_index + 1, dtype = numpy.uint64)
+			products = samples[lo_index : hi_index] * multipliers
+			self._sum_lo += int(numpy.sum(products & 0xffffffff))
+			self._sum_hi += int(numpy.sum(products >> 32))
+		self._position += count
+
+	def to_dict(self):
+		return {
+			"crc32":			"%08x" % (self.crc32),
+			"accuraterip_v1":	"%08x" % (self.accuraterip_v1),
+			"accuraterip_v2":	"%08x" % (self.accuraterip_v2),
+		}
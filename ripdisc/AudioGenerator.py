@@ -19,27 +19,135 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import math
-import struct
-import shutil
 
+import time
+import numpy
+from Tools import WavTools
+
+# Deterministic synthetic audio, independent of how a track is split up
+# into reads
 class AudioGenerator():
-	_WAV_HDR = struct.Struct("< L")
+	SAMPLE_RATE = 44100
+	SAMPLES_PER_SECTOR = 588
+	SECTOR_SIZE = 2352
+	CONTENTS = [ "music", "tones", "noise", "silence" ]
+	_BLOCK_SECTORS = 75 * 10
+
+	def __init__(self, seed = 0, content = "music", glitches = 0):
+		if content not in self.CONTENTS:
+			raise ValueError("Unknown audio content '%s', must be one of %s." % (content, ", ".join(self.CONTENTS)))
+		self._seed = seed
+		self._content = content
+		self._glitches = glitches
 
-	def __init__(self, length_secs = 10):
-		self._length_secs = length_secs
-		self._srate = 44100
-		self._channels = 2
-		self._resolution = 16
+	@property
+	def seed(self):
+		return self._seed
 
 	@property
-	def samples(self):
-		return math.sin(x)
+	def content(self):
+		return self._content
+
+	def _rng(self, *key):
+		return numpy.random.default_rng([ self._seed ] + list(key))
+
+	def _partials(self, track_no):
+		# Every track gets its own chord, in both channels slightly detuned
+		rng = self._rng(track_no, 0)
+		frequencies = rng.uniform(110, 1760, size = 3)
+		amplitudes = rng.uniform(0.05, 0.2, size = 3)
+		detune = rng.uniform(0.995, 1.005, size = 3)
+		return (frequencies, amplitudes, detune)
+
+	def glitches(self, track_no, sectors):
+		# (sector, kind) of injected defects, kind is 'click' or 'dropout'
+		if (self._glitches == 0) or (sectors == 0):
+			return [ ]
+		rng = self._rng(track_no, 1)
+		positions = sorted(rng.integers(0, sectors, size = self._glitches).tolist())
+		kinds = rng.choice([ "click", "dropout" ], size = self._glitches).tolist()
+		return list(zip(positions, kinds))
+
+	def _noise(self, track_no, first_sample, sample_count):
+		# Noise is drawn in fixed blocks so that any window of the track
+		# yields the same values
+		block_samples = self._BLOCK_SECTORS * self.SAMPLES_PER_SECTOR
+		first_block = first_sample // block_samples
+		last_block = (first_sample + sample_count - 1) // block_samples
+		noise = numpy.concatenate([ self._rng(track_no, 2, block).standard_normal(size = (block_samples, 2)) for block in range(first_block, last_block + 1) ])
+		offset = first_sample - first_block * block_samples
+		return noise[offset : offset + sample_count]
 
-	def write_wav(self, output_filename):
-		# TODO: Stupid mock
-		shutil.copy("/usr/share/sounds/sound-icons/pipe.wav", output_filename)
+	def samples(self, track_no, first_sector, sector_count, track_sectors = None):
+		# int16 array with one row per stereo sample
+		first_sample = first_sector * self.SAMPLES_PER_SECTOR
+		sample_count = sector_count * self.SAMPLES_PER_SECTOR
+		signal = numpy.zeros((sample_count, 2))
+		if self._content in [ "music", "tones" ]:
+			t = (first_sample + numpy.arange(sample_count)) / self.SAMPLE_RATE
+			(frequencies, amplitudes, detune) = self._partials(track_no)
+			for (frequency, amplitude, channel_detune) in zip(frequencies, amplitudes, detune):
+				signal[:, 0] += amplitude * numpy.sin(2 * numpy.pi * frequency * t)
+				signal[:, 1] += amplitude * numpy.sin(2 * numpy.pi * frequency * channel_detune * t)
+			if self._content == "music":
+				# Slow tremolo and a noise floor make it less synthetic
+				signal *= (0.75 + 0.25 * numpy.sin(2 * numpy.pi * 0.5 * t))[:, None]
+				signal += 0.003 * self._noise(track_no, first_sample, sample_count)
+		elif self._content == "noise":
+			signal += 0.25 * self._noise(track_no, first_sample, sample_count)
+		pcm = numpy.clip(numpy.round(signal * 32767), -32768, 32767).astype(numpy.int16)
+
+		if track_sectors is not None:
+			for (sector, kind) in self.glitches(track_no, track_sectors):
+				if not (first_sector <= sector < first_sector + sector_count):
+					continue
+				start = (sector - first_sector) * self.SAMPLES_PER_SECTOR
+				if kind == "click":
+					pcm[start : start + 8] = 32767
+				else:
+					pcm[start : start + self.SAMPLES_PER_SECTOR] = 0
+		return pcm
+
+	def track_data(self, track_no, sectors):
+		for first_sector in range(0, sectors, self._BLOCK_SECTORS):
+			count = min(self._BLOCK_SECTORS, sectors - first_sector)
+			yield self.samples(track_no, first_sector, count, track_sectors = sectors).astype("<i2").tobytes()
+
+	def write_wav(self, output_filename, track_no = 1, sectors = 75 * 10, speed = None):
+		# With a speed, no faster than a drive reading at that speed
+		t0 = time.time()
+		written = 0
+		with open(output_filename, "wb") as f:
+			f.write(WavTools.header(sectors * self.SECTOR_SIZE))
+			for data in self.track_data(track_no, sectors):
+				f.write(data)
+				written += len(data)
+				if speed is not None:
+					f.flush()
+					delay = t0 + written / (speed * self.SAMPLE_RATE * 4) - time.time()
+					if delay > 0:
+						time.sleep(delay)
+
+	def write_tracks(self, directory, track_lengths):
+		filenames = [ ]
+		for (track_no, sectors) in enumerate(track_lengths, 1):
+			filename = "audio_%02d.wav" % (track_no)
+			self.write_wav(directory + "/" + filename, track_no = track_no, sectors = sectors)
+			filenames.append(filename)
+		return filenames
 
 if __name__ == "__main__":
-	ag = AudioGenerator()
-	ag.write_wav("x.wav")
+	import sys
+	from FriendlyArgumentParser import FriendlyArgumentParser
+
+	parser = FriendlyArgumentParser(description = "Write one track of deterministic synthetic CD audio to a WAV file.")
+	parser.add_argument("-s", "--seed", metavar = "seed", type = int, default = 0, help = "Seed of the generated audio. Defaults to %(default)d.")
+	parser.add_argument("-c", "--content", choices = AudioGenerator.CONTENTS, default = "music", help = "Kind of audio to generate. Can be one of %(choices)s, defaults to %(default)s.")
+	parser.add_argument("-g", "--glitches", metavar = "count", type = int, default = 0, help = "Number of clicks and dropouts to inject into the track. Defaults to %(default)d.")
+	parser.add_argument("-t", "--track", metavar = "trackno", type = int, default = 1, help = "Track number, every track of a disc has different content. Defaults to %(default)d.")
+	parser.add_argument("-l", "--sectors", metavar = "count", type = int, default = 75 * 10, help = "Length of the track in sectors of 1/75 second. Defaults to %(default)d.")
+	parser.add_argument("--speed", metavar = "factor", type = float, help = "Write no faster than a CD drive at this speed. By default, writes as fast as possible.")
+	parser.add_argument("outfile", metavar = "filename", type = str, help = "WAV file to write")
+	args = parser.parse_args(sys.argv[1:])
+
+	AudioGenerator(seed = args.seed, content = args.content, glitches = args.glitches).write_wav(args.outfile, track_no = args.track, sectors = args.sectors, speed = args.speed)
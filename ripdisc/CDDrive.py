@@ -19,13 +19,18 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import re
 import enum
+import signal
+import contextlib
 import subprocess
 import hashlib
 import base64
 import json
 import time
+import threading
+import concurrent.futures
 
 class MediaType(enum.IntEnum):
 	AudioCD = 0
@@ -49,12 +54,23 @@ class CDMedium():
 	_CDINFO2_REGEX = re.compile("^Application\s*: (?P<application>[^\n]*?)\s*\n.*Volume\s*: (?P<volume>[^\n]*?)\s*\n", flags = re.MULTILINE | re.DOTALL)
 	_WODIM_TRACK_INFO_REGEX = re.compile(r"^track:\s*(?P<trackno>\d+|lout)\s*lba:\s*(?P<offset>\d+)\s*\(\s*\d+\) \d{2}:\d{2}:\d{2}", flags = re.MULTILINE)
 
-	def __init__(self, drive, mock_data = None):
+	_DISCMODES = {
+		"CD-DATA (Mode 1)":		MediaType.DataCD,
+		"DVD-R":				MediaType.DVD,
+	}
+
+	def __init__(self, drive, mock_data = None, probe_cache = None):
 		self._drive = drive
 		self._parsedinfo = { }
+		self._probe_times = { }
+		self._probe_cached = False
+		self._lock = threading.Lock()
+		self._running = { }
+		self._cancelled = set()
+		self._cancel_event = threading.Event()
 		if mock_data is None:
 			self._rawinfo = { }
-			self._check()
+			self._check(probe_cache)
 		else:
 			self._rawinfo = mock_data
 #		print(self._rawinfo)
@@ -66,20 +82,45 @@ class CDMedium():
 		self._media_type = self._determine_media_type()
 		self._media_id = self._determine_media_id()
 
+	@staticmethod
+	def encode_raw_info(rawinfo):
+		return { key: { "type": "bytes", "value": base64.b64encode(value).decode("ascii") } for (key, value) in rawinfo.items() }
+
+	@staticmethod
+	def decode_raw_info(rawinfo):
+		def decode(value):
+			if isinstance(value, dict) and (value.get("type") == "bytes"):
+				return base64.b64decode(value["value"])
+			else:
+				return value
+		return { key: decode(value) for (key, value) in rawinfo.items() }
+
 	def write_raw_info(self, filename):
 		with open(filename, "w") as f:
-			def default_encode(obj):
-				if isinstance(obj, bytes):
-					return {
-						"type":		"bytes",
-						"value":	base64.b64encode(obj).decode("ascii"),
-					}
-			json.dump(self._rawinfo, f, default = default_encode)
+			json.dump(self.encode_raw_info(self._rawinfo), f)
+
+	def write_probe_info(self, filename):
+		with open(filename, "w") as f:
+			json.dump({
+				"fingerprint":	self.fingerprint,
+				"media_type":	self.media_type.name,
+				"rawinfo":		self.encode_raw_info(self._rawinfo),
+			}, f)
 
 	@property
 	def raw_info(self):
 		return self._rawinfo
 
+	@property
+	def fingerprint(self):
+		if "id-musicbrainz" not in self._parsedinfo:
+			return None
+		return self._compute_fingerprint(self._parsedinfo["tracks"])
+
+	@property
+	def probe_cached(self):
+		return self._probe_cached
+
 	@property
 	def media_type(self):
 		return self._media_type
@@ -88,38 +129,67 @@ class CDMedium():
 	def media_id(self):
 		return self._media_id
 
-	def _check_cdparanoia(self):
+	@property
+	def probe_times(self):
+		return self._probe_times
+
+	def _probe(self, name, cmd):
+		with self._lock:
+			if name in self._cancelled:
+				return None
+			proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, start_new_session = True)
+			self._running[name] = proc
 		try:
-			if self._drive.verbose >= 1:
-				print("Trying to determine audio TOC")
-			self._rawinfo["cdparanoia"] = subprocess.check_output([ "cdparanoia", "-Q", "-d", self._drive.device ], stderr = subprocess.STDOUT)
-			return True
-		except subprocess.CalledProcessError:
+			(stdout, _) = proc.communicate()
+		finally:
+			with self._lock:
+				del self._running[name]
+		if proc.returncode != 0:
+			return None
+		with self._lock:
+			if name in self._cancelled:
+				return None
+			self._rawinfo[name] = stdout
+		return stdout
+
+	def _cancel(self, names):
+		# Media type is unambiguous, abort probes that cannot contribute
+		# anymore and stop waiting for their retries.
+		with self._lock:
+			self._cancelled |= set(names)
+			for name in names:
+				if name in self._running:
+					with contextlib.suppress(ProcessLookupError):
+						os.killpg(self._running[name].pid, signal.SIGTERM)
+		self._cancel_event.set()
+
+	def _check_cdparanoia(self):
+		if self._drive.verbose >= 1:
+			print("Trying to determine audio TOC")
+		if self._probe("cdparanoia", [ "cdparanoia", "-Q", "-d", self._drive.device ]) is None:
 			return False
+		self._cancel([ "isoinfo", "cdinfo" ])
+		return True
 
 	def _check_wodim(self):
-		try:
-			if self._drive.verbose >= 1:
-				print("Trying to determine wodim CD info")
-			self._rawinfo["wodim"] = subprocess.check_output([ "wodim", "dev=%s" % (self._drive.device), "-toc" ], stderr = subprocess.STDOUT)
-		except subprocess.CalledProcessError:
-			pass
+		if self._drive.verbose >= 1:
+			print("Trying to determine wodim CD info")
+		self._probe("wodim", [ "wodim", "dev=%s" % (self._drive.device), "-toc" ])
 
 	def _check_isoinfo(self):
-		try:
-			if self._drive.verbose >= 1:
-				print("Trying to determine ISO info")
-			self._rawinfo["isoinfo"] = subprocess.check_output([ "isoinfo", "-d", "-i", self._drive.device ], stderr = subprocess.STDOUT)
-		except subprocess.CalledProcessError:
-			pass
+		if self._drive.verbose >= 1:
+			print("Trying to determine ISO info")
+		self._probe("isoinfo", [ "isoinfo", "-d", "-i", self._drive.device ])
 
 	def _check_cd_info(self):
-		try:
-			if self._drive.verbose >= 1:
-				print("Trying to determine CD info")
-			self._rawinfo["cdinfo"] = subprocess.check_output([ "cd-info", "-C", "--no-tracks", "--dvd", "--no-vcd", "--no-device-info", "--no-cddb", self._drive.device ], stderr = subprocess.STDOUT)
-		except subprocess.CalledProcessError:
-			pass
+		if self._drive.verbose >= 1:
+			print("Trying to determine CD info")
+		stdout = self._probe("cdinfo", [ "cd-info", "-C", "--no-tracks", "--dvd", "--no-vcd", "--no-device-info", "--no-cddb", self._drive.device ])
+		if stdout is None:
+			return
+		match = self._CDINFO1_REGEX.search(stdout.decode("utf-8"))
+		if (match is not None) and (match.groupdict()["discmode"] in self._DISCMODES):
+			self._cancel([ "cdparanoia" ])
 
 	def _compute_cddb_id(self, tracks):
 		def _digitsum(x):
@@ -150,6 +220,37 @@ class CDMedium():
 		encoded = encoded.replace("=", "-")
 		return encoded
 
+	def _compute_fingerprint(self, tracks):
+		return "%s/%s" % (self._compute_musicbrainz_ids(tracks), self._compute_cddb_id(tracks))
+
+	def _parse_wodim(self, wodim_output):
+		tracks = {
+			"content": [ ],
+		}
+		for track in self._WODIM_TRACK_INFO_REGEX.finditer(wodim_output):
+			track = track.groupdict()
+			track_info = { "offset": int(track["offset"]) }
+			if track["trackno"] == "lout":
+				tracks["lout"] = track_info
+			else:
+				trackno = int(track["trackno"])
+				track_info["trackno"] = trackno
+				tracks["content"].append(track_info)
+
+		# Compute length
+		for (track, next_track) in zip(tracks["content"], tracks["content"][1:]):
+			track["length"] = next_track["offset"] - track["offset"]
+
+		if (len(tracks["content"]) >= 1) and ("lout" in tracks):
+			tracks["content"][-1]["length"] = tracks["lout"]["offset"] - tracks["content"][-1]["offset"]
+
+		# Convenience calculations on the track data
+		for track in tracks["content"]:
+			if "length" in track:
+				track["length_bytes"] = track["length"] * 2352
+				track["length_seconds"] = track["length"] / 75
+		return tracks
+
 	def _parse_infos(self):
 		rawinfo_str = { key: value.decode("utf-8") for (key, value) in self._rawinfo.items() }
 
@@ -163,75 +264,76 @@ class CDMedium():
 				self._parsedinfo["cdinfo-app-vol"] = match.groupdict()
 
 		if "wodim" in rawinfo_str:
-			tracks = {
-				"content": [ ],
-			}
-			for track in self._WODIM_TRACK_INFO_REGEX.finditer(rawinfo_str["wodim"]):
-				track = track.groupdict()
-				track_info = { "offset": int(track["offset"]) }
-				if track["trackno"] == "lout":
-					tracks["lout"] = track_info
-				else:
-					trackno = int(track["trackno"])
-					track_info["trackno"] = trackno
-					tracks["content"].append(track_info)
-
-
-			# Inject test data: 49HHV7Eb8UKF3aQiNmu1GR8vKTY- / 3404f606
-			__tracks = {
-				"content": [
-					{ "trackno": 1,	"offset": 0, },
-					{ "trackno": 2,	"offset": 15213 },
-					{ "trackno": 3,	"offset": 32164 },
-					{ "trackno": 4,	"offset": 46442 },
-					{ "trackno": 5,	"offset": 63264 },
-					{ "trackno": 6,	"offset": 80339 },
-				],
-				"lout": { "offset": 95312 }
-			}
-
-			# Compute length
-			for (track, next_track) in zip(tracks["content"], tracks["content"][1:]):
-				track["length"] = next_track["offset"] - track["offset"]
-
-			if (len(tracks["content"]) >= 1) and ("lout" in tracks):
-				tracks["content"][-1]["length"] = tracks["lout"]["offset"] - tracks["content"][-1]["offset"]
-
-			# Convenience calculations on the track data
-			for track in tracks["content"]:
-				if "length" in track:
-					track["length_bytes"] = track["length"] * 2352
-					track["length_seconds"] = track["length"] / 75
-
+			tracks = self._parse_wodim(rawinfo_str["wodim"])
 			self._parsedinfo["tracks"] = tracks
-			self._parsedinfo["id-musicbrainz"] = self._compute_musicbrainz_ids(tracks)
-			self._parsedinfo["id-cddb"] = self._compute_cddb_id(tracks)
+			if len(tracks["content"]) > 0:
+				self._parsedinfo["id-musicbrainz"] = self._compute_musicbrainz_ids(tracks)
+				self._parsedinfo["id-cddb"] = self._compute_cddb_id(tracks)
 
-	def _retry(self, function):
+	def _retry(self, name, function):
 		for retry in range(3):
 			success = function()
-			if success:
+			if success or (name in self._cancelled):
 				break
-			time.sleep(1)
+			self._cancel_event.wait(1)
 
-	def _check(self):
+	def _timed(self, name, function):
+		t0 = time.time()
+		try:
+			function()
+		finally:
+			self._probe_times[name] = time.time() - t0
+
+	def _check_wodim_cached(self, probe_cache):
+		# The TOC identifies an audio CD that we have seen before, the other
+		# probes are then not needed anymore
+		self._check_wodim()
+		if "wodim" not in self._rawinfo:
+			return
+		tracks = self._parse_wodim(self._rawinfo["wodim"].decode("utf-8"))
+		if len(tracks["content"]) == 0:
+			return
+		fingerprint = self._compute_fingerprint(tracks)
+		if fingerprint not in probe_cache:
+			return
+		rawinfo = self.decode_raw_info(probe_cache[fingerprint])
+		if "cdparanoia" not in rawinfo:
+			# Only audio CDs are identified by their TOC, a data disc with
+			# the same layout may have entirely different contents
+			return
+		if self._drive.verbose >= 1:
+			print("Medium with TOC fingerprint %s found in probe cache" % (fingerprint))
+		self._cancel([ "cdparanoia", "isoinfo", "cdinfo" ])
+		with self._lock:
+			rawinfo["wodim"] = self._rawinfo["wodim"]
+			self._rawinfo = rawinfo
+		self._probe_cached = True
+
+	def _check(self, probe_cache = None):
+		probes = [ ]
 		if self._drive.can_handle_media_type([ MediaType.AudioCD ]):
-			self._retry(self._check_cdparanoia)
-			self._check_wodim()
+			probes.append(("cdparanoia", lambda: self._retry("cdparanoia", self._check_cdparanoia)))
+			if probe_cache is not None:
+				probes.append(("wodim", lambda: self._check_wodim_cached(probe_cache)))
+			else:
+				probes.append(("wodim", self._check_wodim))
 
 		if self._drive.can_handle_media_type([ MediaType.DataCD, MediaType.DVD, MediaType.BluRay ]):
-			self._check_isoinfo()
-			self._check_cd_info()
+			probes.append(("isoinfo", self._check_isoinfo))
+			probes.append(("cdinfo", self._check_cd_info))
+
+		# All probes are independent of each other, run them concurrently
+		with concurrent.futures.ThreadPoolExecutor(max_workers = max(len(probes), 1)) as executor:
+			futures = [ executor.submit(self._timed, name, function) for (name, function) in probes ]
+			for future in futures:
+				future.result()
 
 	def _determine_media_type(self):
 		media_type = MediaType.Unknown
 		if "cdparanoia" in self._rawinfo:
 			media_type = MediaType.AudioCD
 		elif "cdinfo-discmode" in self._parsedinfo:
-			if self._parsedinfo["cdinfo-discmode"]["discmode"] == "CD-DATA (Mode 1)":
-				media_type = MediaType.DataCD
-			elif self._parsedinfo["cdinfo-discmode"]["discmode"] == "DVD-R":
-				media_type = MediaType.DVD
+			media_type = self._DISCMODES.get(self._parsedinfo["cdinfo-discmode"]["discmode"], MediaType.Unknown)
 		return media_type
 
 	def _determine_media_id(self):
@@ -260,14 +362,17 @@ class CDMedium():
 class CDDrive():
 	_DEV_REGEX = re.compile("^Vendor\s*:\s*(?P<vendor>[^\n]*?)\s*\n.*Model\s*:\s*(?P<model>[^\n]*?)\s*\nRevision\s*:\s*(?P<revision>[^\n]*?)\s*\n", flags = re.MULTILINE | re.DOTALL)
 
-	def __init__(self, device, restrict_media_types = None, verbose = 0, mock_data = None):
+	def __init__(self, device, restrict_media_types = None, verbose = 0, mock_data = None, probe_cache = None):
 		self._device = device
 		self._drive_id = None
 		self._media_type = None
 		self._media_id = None
+		self._probe_times = None
 		self._restrict_media_types = restrict_media_types
 		self._verbose = verbose
 		self._mock_data = mock_data
+		self._probe_cache = probe_cache
+		self._medium = None
 
 	@property
 	def verbose(self):
@@ -298,6 +403,23 @@ class CDDrive():
 			self.check_media_id()
 		return self._media_id
 
+	@property
+	def probe_times(self):
+		if self._probe_times is None:
+			self.check_media_id()
+		return self._probe_times
+
+	@property
+	def probe_cached(self):
+		if self._medium is None:
+			self.check_media_id()
+		return self._medium.probe_cached
+
+	def write_probe_info(self, filename):
+		if self._medium is None:
+			self.check_media_id()
+		self._medium.write_probe_info(filename)
+
 	def check_drive_id(self):
 		if self._verbose >= 1:
 			print("Checking drive ID of %s" % (self._device))
@@ -319,9 +441,11 @@ class CDDrive():
 	def check_media_id(self):
 		if self._verbose >= 1:
 			print("Checking media ID of %s" % (self._device))
-		medium = CDMedium(self, mock_data = self._mock_data)
+		medium = CDMedium(self, mock_data = self._mock_data, probe_cache = self._probe_cache)
+		self._medium = medium
 		self._media_type = medium.media_type
 		self._media_id = medium.media_id
+		self._probe_times = medium.probe_times
 		if self._media_type == MediaType.Unknown:
 			if len(medium.raw_info) == 0:
 				raise Exception("No medium detected.")
@@ -0,0 +1,130 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import re
+import sys
+import signal
+import asyncio
+import collections
+from StreamPump import StreamPump
+from DeathSig import set_pdeathsig
+
+# Runs a command or a pipeline of two; output that the parser does not
+# recognize is kept in a bounded tail for error diagnosis
+class CommandRunner():
+	_ESCAPE_REGEX = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+	def __init__(self, command, sink = None, consumer = None, skip = 0, output_parser = None, tail_lines = 25, echo = False):
+		self._command = command
+		self._sink = sink
+		self._consumer = consumer
+		self._skip = skip
+		self._output_parser = output_parser
+		self._tail = collections.deque(maxlen = tail_lines)
+		self._echo = echo
+		self._pump = None
+		self._pipeline = (sink is not None) or (consumer is not None)
+
+	@property
+	def pump(self):
+		return self._pump
+
+	@property
+	def tail(self):
+		return list(self._tail)
+
+	def _process_line(self, line, on_output):
+		line = self._ESCAPE_REGEX.sub("", line)
+		if self._echo:
+			print(line, file = sys.stderr)
+		if line.strip() == "":
+			return
+		if (self._output_parser is not None) and self._output_parser.feed_line(line):
+			if on_output is not None:
+				on_output()
+		else:
+			self._tail.append(line)
+
+	async def _read_output(self, stream, on_output):
+		buffer = b""
+		while True:
+			chunk = await stream.read(4096)
+			if len(chunk) == 0:
+				break
+			# Progress lines are commonly terminated by a carriage return only
+			lines = re.split(rb"[\r\n]", buffer + chunk)
+			buffer = lines.pop()
+			for line in lines:
+				self._process_line(line.decode("utf-8", errors = "replace"), on_output)
+		if len(buffer) > 0:
+			self._process_line(buffer.decode("utf-8", errors = "replace"), on_output)
+
+	async def _start(self, command, **kwargs):
+		return await asyncio.create_subprocess_exec(*command, preexec_fn = lambda: set_pdeathsig(signal.SIGKILL), **kwargs)
+
+	async def _run_pump(self, source):
+		if not await self._pump.run():
+			# Nobody is reading anymore, the source would block forever
+			source.kill()
+
+	async def _tick(self, tick, interval):
+		while True:
+			await asyncio.sleep(interval)
+			tick()
+
+	async def run(self, tick = None, tick_interval = 5, on_output = None):
+		# Returns the exit codes of all processes
+		readers = [ ]
+		if not self._pipeline:
+			procs = [ await self._start(self._command, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE) ]
+			readers += [ self._read_output(procs[0].stdout, on_output), self._read_output(procs[0].stderr, on_output) ]
+		else:
+			source = await self._start(self._command, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE)
+			readers.append(self._read_output(source.stderr, on_output))
+			if self._sink is not None:
+				sink = await self._start(self._sink, stdin = asyncio.subprocess.PIPE, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.STDOUT)
+				readers.append(self._read_output(sink.stdout, on_output))
+				procs = [ source, sink ]
+			else:
+				# Data is only consumed by ourselves
+				sink = None
+				procs = [ source ]
+			self._pump = StreamPump(source.stdout, None if (sink is None) else sink.stdin, skip = self._skip)
+			if self._consumer is not None:
+				self._pump.add_consumer(self._consumer)
+			readers.append(self._run_pump(source))
+
+		ticker = None if (tick is None) else asyncio.ensure_future(self._tick(tick, tick_interval))
+		try:
+			await asyncio.gather(*readers)
+			results = [ await proc.wait() for proc in procs ]
+		finally:
+			if ticker is not None:
+				ticker.cancel()
+			for proc in procs:
+				if proc.returncode is None:
+					proc.kill()
+					await proc.wait()
+		if (ticker is not None) and ticker.done() and (not ticker.cancelled()) and (ticker.exception() is not None):
+			# The tick task is never awaited, its failure would go unnoticed
+			raise ticker.exception()
+		return results
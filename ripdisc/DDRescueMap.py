@@ -0,0 +1,155 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import re
+import datetime
+
+class DDRescueMap():
+	_EXTENT_REGEX = re.compile(r"^(?P<pos>0x[0-9a-fA-F]+)\s+(?P<size>0x[0-9a-fA-F]+)\s+(?P<status>[?*/\-+])\s*$")
+	_CURRENT_REGEX = re.compile(r"^(?P<pos>0x[0-9a-fA-F]+)\s+(?P<status>[?*/\-+FGR])(\s+(?P<pass>\d+))?\s*$")
+
+	NonTried = "?"
+	NonTrimmed = "*"
+	NonScraped = "/"
+	BadSector = "-"
+	Finished = "+"
+
+	def __init__(self, size = None):
+		self._current_pos = 0
+		self._current_status = "?"
+		self._current_pass = 1
+		if size is None:
+			self._extents = [ ]
+		else:
+			self._extents = [ [ 0, size, self.NonTried ] ]
+
+	@classmethod
+	def parse(cls, text):
+		rescue_map = cls()
+		have_current = False
+		for line in text.split("\n"):
+			line = line.strip()
+			if line.startswith("#") or (line == ""):
+				continue
+			if not have_current:
+				match = cls._CURRENT_REGEX.match(line)
+				if match is not None:
+					match = match.groupdict()
+					rescue_map._current_pos = int(match["pos"], 16)
+					rescue_map._current_status = match["status"]
+					rescue_map._current_pass = int(match["pass"] or 1)
+					have_current = True
+					continue
+			match = cls._EXTENT_REGEX.match(line)
+			if match is not None:
+				match = match.groupdict()
+				rescue_map._extents.append([ int(match["pos"], 16), int(match["size"], 16), match["status"] ])
+		return rescue_map
+
+	@classmethod
+	def load(cls, filename):
+		with open(filename) as f:
+			return cls.parse(f.read())
+
+	def write(self, f, command_line = None):
+		now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		print("# Mapfile. Created by GNU ddrescue version 1.23", file = f)
+		if command_line is not None:
+			print("# Command line: %s" % (command_line), file = f)
+		print("# Current time: %s" % (now), file = f)
+		print("# current_pos  current_status  current_pass", file = f)
+		print("0x%08X     %s               %d" % (self._current_pos, self._current_status, self._current_pass), file = f)
+		print("#      pos        size  status", file = f)
+		for (pos, size, status) in self._extents:
+			print("0x%08X  0x%08X  %s" % (pos, size, status), file = f)
+
+	def save(self, filename, command_line = None):
+		with open(filename, "w") as f:
+			self.write(f, command_line = command_line)
+
+	@property
+	def size(self):
+		if len(self._extents) == 0:
+			return 0
+		return self._extents[-1][0] + self._extents[-1][1]
+
+	def set_current(self, pos, status, current_pass = None):
+		self._current_pos = pos
+		self._current_status = status
+		if current_pass is not None:
+			self._current_pass = current_pass
+
+	def set_status(self, pos, size, status):
+		end = pos + size
+		extents = [ ]
+		for (ext_pos, ext_size, ext_status) in self._extents:
+			ext_end = ext_pos + ext_size
+			if (ext_end <= pos) or (ext_pos >= end):
+				extents.append([ ext_pos, ext_size, ext_status ])
+				continue
+			if ext_pos < pos:
+				extents.append([ ext_pos, pos - ext_pos, ext_status ])
+			if (len(extents) == 0) or (extents[-1][0] + extents[-1][1] <= pos):
+				extents.append([ pos, size, status ])
+			if ext_end > end:
+				extents.append([ end, ext_end - end, ext_status ])
+
+		# Merge adjacent extents of identical status
+		self._extents = [ ]
+		for extent in extents:
+			if (len(self._extents) > 0) and (self._extents[-1][2] == extent[2]):
+				self._extents[-1][1] += extent[1]
+			else:
+				self._extents.append(extent)
+
+	def extents(self, statuses = None):
+		for (pos, size, status) in self._extents:
+			if (statuses is None) or (status in statuses):
+				yield (pos, size, status)
+
+	@property
+	def finished_prefix(self):
+		# Bytes at the start of the map that are completely rescued
+		if (len(self._extents) == 0) or (self._extents[0][2] != self.Finished):
+			return 0
+		return self._extents[0][1]
+
+	def byte_counts(self):
+		counts = { status: 0 for status in (self.NonTried, self.NonTrimmed, self.NonScraped, self.BadSector, self.Finished) }
+		for (pos, size, status) in self._extents:
+			counts[status] += size
+		return counts
+
+	def overview(self, bins):
+		# One status character per bin, the least favorable one within it
+		total_size = self.size
+		if total_size == 0:
+			return ""
+		severity = [ self.Finished, self.NonTried, self.NonTrimmed, self.NonScraped, self.BadSector ]
+		result = [ 0 ] * bins
+		for (pos, size, status) in self._extents:
+			if status == self.Finished:
+				continue
+			level = severity.index(status)
+			for index in range(pos * bins // total_size, (pos + size - 1) * bins // total_size + 1):
+				result[index] = max(result[index], level)
+		return "".join(severity[level] for level in result)
@@ -154,6 +154,10 @@ class GnuplotFile():
 		with open(filename, "wb") as f:
 			self.render_png(f)
 
+	def render_gplfile(self, filename):
+		with open(filename, "w") as f:
+			self.render_gpl(f)
+
 if __name__ == "__main__":
 	gpl = GnuplotFile()
 	gpl.xlabel = "Time (secs)"
@@ -0,0 +1,88 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import hashlib
+import threading
+
+# Hashes an image while another process still writes it, reading the data
+# back while it is still in the page cache
+class ImageHasher(threading.Thread):
+	def __init__(self, filename, algorithms = ("sha256", ), chunk_size = 1024 * 1024):
+		super().__init__(daemon = True)
+		self._filename = filename
+		self._hashes = { algorithm: hashlib.new(algorithm) for algorithm in algorithms }
+		self._chunk_size = chunk_size
+		self._offset = 0
+		self._limit = 0
+		self._final = False
+		self._cond = threading.Condition()
+
+	@property
+	def bytes_hashed(self):
+		return self._offset
+
+	@property
+	def hexdigests(self):
+		return { algorithm: hashfnc.hexdigest() for (algorithm, hashfnc) in self._hashes.items() }
+
+	def advance(self, limit):
+		# Everything in front of limit will not change anymore
+		with self._cond:
+			if limit > self._limit:
+				self._limit = limit
+				self._cond.notify()
+
+	def finish(self, size):
+		# Writer is done, returns the digests of the first size bytes
+		with self._cond:
+			self._limit = size
+			self._final = True
+			self._cond.notify()
+		self.join()
+		return self.hexdigests
+
+	def _next_chunk_size(self):
+		with self._cond:
+			while (self._offset >= self._limit) and (not self._final):
+				self._cond.wait()
+			return min(self._limit - self._offset, self._chunk_size)
+
+	def run(self):
+		f = None
+		try:
+			while True:
+				chunk_size = self._next_chunk_size()
+				if chunk_size <= 0:
+					break
+				if f is None:
+					f = open(self._filename, "rb")
+				f.seek(self._offset)
+				chunk = f.read(chunk_size)
+				if len(chunk) == 0:
+					# Writer never extended the image up to the full size
+					break
+				for hashfnc in self._hashes.values():
+					hashfnc.update(chunk)
+				self._offset += len(chunk)
+		finally:
+			if f is not None:
+				f.close()
@@ -0,0 +1,104 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import re
+
+class OutputParser():
+	def feed_line(self, line):
+		# True for lines that were recognized as progress information
+		return False
+
+class DDRescueOutput(OutputParser):
+	_RESCUED_REGEX = re.compile(r"rescued:\s*(?P<value>[0-9.]+)\s*(?P<unit>[kMGTP]?)B")
+	_BAD_REGEX = re.compile(r"bad[- ]sector:\s*(?P<value>[0-9.]+)\s*(?P<unit>[kMGTP]?)B")
+	_STATUS_REGEX = re.compile(r"^\s*(ipos:|opos:|non-tried:|rescued:|pct rescued:|time since|Copying|Trimming|Scraping|Retrying|Finished)")
+	_UNITS = { "": 1, "k": 1000, "M": 1000 ** 2, "G": 1000 ** 3, "T": 1000 ** 4, "P": 1000 ** 5 }
+
+	def __init__(self):
+		self.rescued = None
+		self.bad = None
+		self.phase = None
+
+	def _value(self, match):
+		return round(float(match["value"]) * self._UNITS[match["unit"]])
+
+	def feed_line(self, line):
+		if self._STATUS_REGEX.match(line) is None:
+			return False
+		match = self._RESCUED_REGEX.search(line)
+		if match is not None:
+			self.rescued = self._value(match)
+		match = self._BAD_REGEX.search(line)
+		if match is not None:
+			self.bad = self._value(match)
+		if line.startswith(("Copying", "Trimming", "Scraping", "Retrying", "Finished")):
+			self.phase = line.strip()
+		return True
+
+class Cdda2wavOutput(OutputParser):
+	_PERCENT_REGEX = re.compile(r"^\s*(?P<percent>\d+)%\s*$")
+	_TRACK_DONE_REGEX = re.compile(r"^\s*100%\s+track\s+(?P<trackno>\d+)\s+recorded\s+successfully")
+
+	def __init__(self, first_track = 1, on_track_done = None):
+		self.track = first_track
+		self.percent = 0
+		self._on_track_done = on_track_done
+
+	def feed_line(self, line):
+		match = self._TRACK_DONE_REGEX.match(line)
+		if match is not None:
+			trackno = int(match["trackno"])
+			self.track = trackno + 1
+			self.percent = 0
+			if self._on_track_done is not None:
+				self._on_track_done(trackno)
+			return True
+		match = self._PERCENT_REGEX.match(line)
+		if match is not None:
+			self.percent = int(match["percent"])
+			return True
+		return False
+
+# Progress that cdparanoia prints with -e, positions are in 16-bit words
+class CdparanoiaOutput(OutputParser):
+	_EVENT_REGEX = re.compile(r"^##:\s*(?P<code>-?\d+)\s*\[(?P<name>[^\]]*)\]\s*@\s*(?P<pos>\d+)")
+	_WROTE = -2
+	_SKIP = 6
+	_ERRORS = set([ 4, 6, 10, 11, 12 ])	# scratch, skip, dropped, duped, read error
+
+	def __init__(self):
+		self.position = 0
+		self.errors = 0
+		self.skips = 0
+
+	def feed_line(self, line):
+		match = self._EVENT_REGEX.match(line)
+		if match is None:
+			return False
+		code = int(match["code"])
+		if code == self._WROTE:
+			self.position = int(match["pos"]) * 2
+		elif code in self._ERRORS:
+			self.errors += 1
+			if code == self._SKIP:
+				self.skips += 1
+		return True
@@ -0,0 +1,117 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import fcntl
+
+# Read speed for every region of an audio CD: slower when errors pile up,
+# faster again after consecutive clean regions
+class ReadSpeedController():
+	SPEEDS = [ 1, 2, 4, 8, 12, 16, 24, 32, 40, 48, 52 ]
+	BYTES_PER_SEC_1X = 176400
+
+	def __init__(self, max_speed = 48, start_speed = None, max_error_rate = 1, clean_regions_to_speed_up = 2):
+		self._speeds = [ speed for speed in self.SPEEDS if speed < max_speed ] + [ max_speed ]
+		if start_speed is None:
+			self._index = len(self._speeds) - 1
+		else:
+			self._index = max([ 0 ] + [ index for (index, speed) in enumerate(self._speeds) if speed <= start_speed ])
+		self._max_error_rate = max_error_rate
+		self._clean_regions_to_speed_up = clean_regions_to_speed_up
+		self._clean_streak = 0
+		self._history = [ ]
+
+	@property
+	def speed(self):
+		return self._speeds[self._index]
+
+	@property
+	def history(self):
+		return self._history
+
+	def region_done(self, first_sector, sector_count, errors, skips, elapsed):
+		throughput = (sector_count * 2352 / elapsed) if (elapsed > 0) else None
+		# Errors per thousand sectors
+		error_rate = 1000 * errors / max(sector_count, 1)
+		self._history.append({
+			"first_sector":	first_sector,
+			"sectors":		sector_count,
+			"speed":		self.speed,
+			"errors":		errors,
+			"skips":		skips,
+			"throughput":	throughput,
+		})
+
+		if (skips > 0) or (error_rate > self._max_error_rate):
+			# Unrecoverable sectors are the worst outcome, back off harder
+			self._index = max(self._index - (2 if (skips > 0) else 1), 0)
+			self._clean_streak = 0
+		elif (errors > 0) and (self._index > 0) and (throughput is not None) and (throughput < self._speeds[self._index - 1] * self.BYTES_PER_SEC_1X):
+			# Retries cost more time than reading slower would
+			self._index -= 1
+			self._clean_streak = 0
+		elif errors == 0:
+			self._clean_streak += 1
+			if (self._clean_streak >= self._clean_regions_to_speed_up) and (self._index < len(self._speeds) - 1):
+				self._index += 1
+				self._clean_streak = 0
+		else:
+			self._clean_streak = 0
+
+	@property
+	def start_speed(self):
+		# Recommended speed for the next rip in this drive model: the
+		# highest speed that read a region without any errors
+		clean_speeds = [ region["speed"] for region in self._history if region["errors"] == 0 ]
+		if len(clean_speeds) > 0:
+			return max(clean_speeds)
+		return self.speed
+
+	@staticmethod
+	def _load_profiles(filename):
+		try:
+			with open(filename) as f:
+				return json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return { }
+
+	@classmethod
+	def from_profile(cls, filename, drive_model, max_speed = 48):
+		profile = cls._load_profiles(filename).get(drive_model)
+		start_speed = None if (profile is None) else profile["start_speed"]
+		return cls(max_speed = max_speed, start_speed = start_speed)
+
+	def save_profile(self, filename, drive_model):
+		# Several rips may update the profiles at the same time. The lock is
+		# on a separate file because the profile file itself is replaced.
+		with open(filename + ".lock", "w") as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			profiles = self._load_profiles(filename)
+			profiles[drive_model] = {
+				"start_speed":	self.start_speed,
+				"regions":		self._history,
+			}
+			tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+			with open(tmp_filename, "w") as f:
+				json.dump(profiles, f, indent = 4, sort_keys = True)
+			os.replace(tmp_filename, filename)
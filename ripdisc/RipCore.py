@@ -20,47 +20,75 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import sys
 import json
 import shutil
 import datetime
 import subprocess
 import signal
-import base64
 import time
-from CDDrive import CDDrive, MediaType
-from Tools import FileTools
+import math
+import asyncio
+import collections
+from CDDrive import CDDrive, CDMedium, MediaType
+from Tools import FileTools, WavTools, WavFollower, TrackDemux
 from SpeedAverager import SpeedAverager
 from SpeedMonitor import SpeedMonitor
 from DeathSig import set_pdeathsig
-from AudioGenerator import AudioGenerator
+from CommandRunner import CommandRunner
+from OutputParsers import DDRescueOutput, Cdda2wavOutput, CdparanoiaOutput
+from ReadSpeedController import ReadSpeedController
+from ImageHasher import ImageHasher
+from DDRescueMap import DDRescueMap
 
 class RipCore():
+	_Pipeline = collections.namedtuple("Pipeline", [ "source", "sink", "consumer" ], defaults = [ None ])
+	_MIN_OUTPUT_UPDATE_INTERVAL = 0.25
+
 	def __init__(self, args):
 		self._args = args
 		restrict_media_types = set([ MediaType.from_str(media_type) for media_type in self._args.force_medium ])
 		if len(restrict_media_types) == 0:
 			restrict_media_types = None
 		if self._args.mock is None:
-			self._drive = CDDrive(self._args.drive, restrict_media_types = restrict_media_types, verbose = self._args.verbose)
+			if self._args.probe_cache is not None:
+				with open(self._args.probe_cache) as f:
+					probe_cache = json.load(f)
+			else:
+				probe_cache = None
+			self._drive = CDDrive(self._args.drive, restrict_media_types = restrict_media_types, verbose = self._args.verbose, probe_cache = probe_cache)
 		else:
-			dirname = os.path.dirname(__file__)
-			with open(dirname + "/mock_" + self._args.mock + ".json") as f:
-				mock_data = json.load(f)
-			def decode(value):
-				if isinstance(value, dict) and (value.get("type") == "bytes"):
-					return base64.b64decode(value["value"])
-				else:
-					return value
-			mock_data = { key: decode(value) for (key, value) in mock_data.items() }
+			if self._args.mock_toc is not None:
+				mock_filename = self._args.mock_toc
+			else:
+				mock_filename = os.path.dirname(__file__) + "/mock_" + self._args.mock + ".json"
+			with open(mock_filename) as f:
+				mock_data = CDMedium.decode_raw_info(json.load(f))
 			self._drive = CDDrive(self._args.drive, mock_data = mock_data, verbose = self._args.verbose)
 		self._state = "idle"
 		self._error = None
 		self._progress = None
 		self._files = None
-		self._speed_monitor = SpeedMonitor()
+		self._tracks_done = [ ]
+		self._verification = None
+		self._checksums = None
+		self._badmap = None
+		self._output_tail = None
+		self._cuesheet = None
+		self._read_speed = None
+		self._manifest = None
+		self._resume_state = None
+		self._resumed = None
+		self._resumed_checksums = { }
+		self._speed_monitor = SpeedMonitor(max_points = self._args.graph_points)
+		self._runner = None
 		self._start_utc = datetime.datetime.utcnow()
+		if self._args.status_fd is not None:
+			self._status_channel = os.fdopen(self._args.status_fd, "w")
+		else:
+			self._status_channel = None
 
-	def write_status(self):
+	def _get_status(self, include_graph = True):
 		now = datetime.datetime.utcnow()
 		status = {
 			"drive": self._drive.drive_id,
@@ -68,6 +96,8 @@ class RipCore():
 			"medium": {
 				"type":		self._drive.media_type.name,
 				"info":		self._drive.media_id,
+				"probe_times":	self._drive.probe_times,
+				"probe_cached":	self._drive.probe_cached,
 			},
 			"state": self._state,
 			"error": self._error,
@@ -84,50 +114,149 @@ class RipCore():
 				},
 			},
 			"files": self._files,
+			"cuesheet": self._cuesheet,
+			"read_speed": self._read_speed,
+			"manifest": self._manifest,
+			"resumed": self._resumed,
+			"tracks_done": self._tracks_done,
+			"verification": self._verification,
+			"checksums": self._checksum_status(),
+			"badmap": self._badmap,
+			"output_tail": self._output_tail,
 		}
-		with open(self._args.destdir + "/state.json", "w") as f:
+		if not include_graph:
+			del status["graph"]
+		return status
+
+	def _checksum_status(self):
+		if self._checksums is None:
+			return None
+		result = [ ]
+		for (track_no, checksum) in sorted(self._checksums.items()):
+			if track_no in self._resumed_checksums:
+				result.append(self._resumed_checksums[track_no])
+			elif checksum.complete:
+				entry = { "trackno": track_no }
+				entry.update(checksum.to_dict())
+				result.append(entry)
+		return result
+
+	def _send_status(self, status):
+		if self._status_channel is None:
+			return False
+		try:
+			self._status_channel.write(json.dumps(status) + "\n")
+			self._status_channel.flush()
+			return True
+		except BrokenPipeError:
+			# Parent went away, fall back to writing state.json
+			self._status_channel = None
+			return False
+
+	def write_status(self):
+		status = self._get_status()
+		# Replace atomically, state.json is read by others while we rip
+		with open(self._args.destdir + "/state.json.tmp", "w") as f:
 			if self._args.verbose:
 				json.dump(status, f, sort_keys = True, indent = 4)
 				f.write("\n")
 			else:
 				json.dump(status, f)
+		os.replace(self._args.destdir + "/state.json.tmp", self._args.destdir + "/state.json")
+		self._send_status(self._get_status(include_graph = False))
+
+	def _report_progress(self):
+		# Only phase transitions are persisted in state.json when there is a
+		# listener for progress events; otherwise, it's the only place to go.
+		if not self._send_status(self._get_status(include_graph = False)):
+			self.write_status()
+
+	def _command_runner(self, command, output_parser):
+		if isinstance(command, self._Pipeline):
+			runner = CommandRunner(command.source, sink = command.sink, consumer = command.consumer, skip = WavTools.HEADER_SIZE, output_parser = output_parser, echo = (self._args.verbose >= 2))
+		else:
+			runner = CommandRunner(command, output_parser = output_parser, echo = (self._args.verbose >= 2))
+		return runner
+
+	def _track_completed(self, track_no, filename):
+		# Announce finished tracks so that postprocessing can pick them up
+		# while the rest of the disc is still being read
+		if track_no not in [ entry["trackno"] for entry in self._tracks_done ]:
+			self._tracks_done.append({
+				"trackno":	track_no,
+				"file":		filename,
+			})
+			self.write_status()
+
+	def _execute_cmds(self, commands, progress, disc_size, before_command = None, after_command = None, output_parser = None):
+		speed = SpeedAverager(ewma_secs = self._args.speed_ewma)
+		last_update = [ 0 ]
+
+		def _update_progress(from_output = False):
+			now = time.time()
+			if from_output and (now - last_update[0] < self._MIN_OUTPUT_UPDATE_INTERVAL):
+				return
+			last_update[0] = now
+			pos = progress()
+			speed.add(pos)
+			self._progress["bytes_read"] = pos
+			self._progress["speed"] = speed.real_speed
+			self._progress["eta"] = speed.eta(disc_size - pos)
+			self._speed_monitor.record(pos)
+			self._report_progress()
 
-	def _execute_cmds(self, commands, progress, disc_size):
-		speed = SpeedAverager()
 		for (cid, command) in enumerate(commands, 1):
+			if (before_command is not None) and (not before_command(cid, command)):
+				# Command is not necessary (anymore)
+				continue
+			if callable(command):
+				# Command depends on the outcome of the previous ones
+				command = command()
 			if self._args.verbose >= 1:
-				print(" ".join(command))
+				if isinstance(command, self._Pipeline):
+					if command.sink is not None:
+						print("%s | %s" % (" ".join(command.source), " ".join(command.sink)))
+					else:
+						print(" ".join(command.source))
+				else:
+					print(" ".join(command))
 			pos = progress()
 			speed.add(pos)
+			if isinstance(command, self._Pipeline):
+				# Only report the processes, not our own consumer
+				reported_command = [ command.source, command.sink ]
+			else:
+				reported_command = command
 			self._progress = {
-				"command":	command,
+				"command":	reported_command,
 				"number": cid,
 				"total": len(commands),
 				"bytes_read": pos,
 				"disc_size": disc_size,
 				"speed": speed.real_speed,
+				"eta": speed.eta(disc_size - pos),
 			}
 			self.write_status()
-			if self._args.verbose >= 2:
-				output = None
-			else:
-				output = subprocess.DEVNULL
-			proc = subprocess.Popen(command, stdout = output, stderr = output, preexec_fn = lambda: set_pdeathsig(signal.SIGKILL))
-			while True:
-				try:
-					result = proc.wait(self._args.update_delay)
-					if result == 0:
-						break
-					else:
-						raise Exception("Process failed with return code %d." % (result))
-				except subprocess.TimeoutExpired:
-					pos = progress()
-					speed.add(pos)
-					self._progress["bytes_read"] = pos
-					self._progress["speed"] = speed.real_speed
-					self._speed_monitor.record(pos)
-					self.write_status()
-		self._progress["bytes_read"] = progress()
+			runner = self._command_runner(command, output_parser)
+			self._runner = runner
+			# Progress is updated as soon as the tool prints it; the timer
+			# covers tools whose output we cannot parse.
+			results = asyncio.run(runner.run(tick = _update_progress, tick_interval = self._args.update_delay, on_output = lambda: _update_progress(from_output = True)))
+			failed = [ result for result in results if result != 0 ]
+			if len(failed) > 0:
+				self._state = "error"
+				# Prefer real exit codes over a source we killed after its sink died
+				self._error = "Process failed with return code %d." % (max(failed) if (max(failed) > 0) else failed[0])
+				# Last lines of output that were not progress information
+				self._output_tail = runner.tail
+				self.write_status()
+				raise Exception(self._error)
+			if after_command is not None:
+				after_command(cid, command)
+		if self._progress is not None:
+			self._progress["bytes_read"] = progress()
+			# All commands are through, a remaining estimate would be stale
+			self._progress["eta"] = 0
 		self.write_status()
 
 	def _rip_data_cd(self, destination_dir, image_filename = "image.iso"):
@@ -136,16 +265,90 @@ class RipCore():
 		ddrescue_log = destination_dir + "/ddrescue.log"
 		commands = [
 			[ "ddrescue", "-n", "-a", "100000", "-b", "2048", "-c", "512", self._drive.device, outfile, ddrescue_log ],
+
+			# Escalating strategies, each one only works on the areas that the
+			# previous passes left behind
 			[ "ddrescue", "-d", "-a", "100000", "-b", "2048", "-c", "512", self._drive.device, outfile, ddrescue_log ],
+			[ "ddrescue", "-d", "-r", "3", "-b", "2048", "-c", "1", self._drive.device, outfile, ddrescue_log ],
+			[ "ddrescue", "-d", "-R", "-r", "3", "-b", "2048", "-c", "1", self._drive.device, outfile, ddrescue_log ],
 		]
-		def _determine_progress():
+		disc_size = FileTools.get_filesize(self._drive.device)
+		if self._resume_state is not None:
+			# ddrescue continues from its mapfile by itself
+			try:
+				self._resumed = { "bytes": DDRescueMap.load(ddrescue_log).byte_counts()[DDRescueMap.Finished] }
+			except FileNotFoundError:
+				pass
+		output_parser = DDRescueOutput()
+		last_load = [ 0 ]
+		if len(self._args.image_hash) > 0:
+			hasher = ImageHasher(outfile, algorithms = self._args.image_hash)
+			hasher.start()
+		else:
+			hasher = None
+
+		def _update_badmap(force = False):
+			# Live progress comes from ddrescue's output, the mapfile is only
+			# needed for the bad map and to decide on further passes
+			now = time.time()
+			if (not force) and (now - last_load[0] < self._args.update_delay):
+				return
+			last_load[0] = now
 			try:
-				return FileTools.get_filesize(outfile)
+				rescue_map = DDRescueMap.load(ddrescue_log)
 			except FileNotFoundError:
+				return
+			if rescue_map.size != disc_size:
+				# Caught ddrescue while rewriting the mapfile
+				return
+			if hasher is not None:
+				hasher.advance(rescue_map.finished_prefix)
+			counts = rescue_map.byte_counts()
+			self._badmap = {
+				"rescued":		counts[DDRescueMap.Finished],
+				"non_tried":	counts[DDRescueMap.NonTried],
+				"non_trimmed":	counts[DDRescueMap.NonTrimmed],
+				"non_scraped":	counts[DDRescueMap.NonScraped],
+				"bad":			counts[DDRescueMap.BadSector],
+				"overview":		rescue_map.overview(256),
+				"bad_extents":	[ [ pos, size, status ] for (pos, size, status) in rescue_map.extents(statuses = DDRescueMap.NonTrimmed + DDRescueMap.NonScraped + DDRescueMap.BadSector) ][:64],
+			}
+
+		def _determine_progress():
+			_update_badmap()
+			if output_parser.rescued is not None:
+				return output_parser.rescued
+			elif self._badmap is not None:
+				return self._badmap["rescued"]
+			else:
 				return 0
 
-		disc_size = FileTools.get_filesize(self._drive.device)
-		self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size)
+		def _need_pass(cid, command):
+			if cid == 1:
+				return True
+			_update_badmap(force = True)
+			return (self._badmap is None) or (self._badmap["rescued"] < disc_size)
+
+		self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size, before_command = _need_pass, output_parser = output_parser)
+		_update_badmap(force = True)
+		if self._badmap is not None:
+			# Exact count, ddrescue's output is rounded
+			self._progress["bytes_read"] = self._badmap["rescued"]
+			self.write_status()
+		if hasher is not None:
+			self._write_manifest(destination_dir, image_filename, hashes = hasher.finish(disc_size), size = hasher.bytes_hashed)
+
+	def _write_manifest(self, destination_dir, image_filename, hashes, size):
+		self._manifest = {
+			"image":		image_filename,
+			"size":			size,
+			"complete":		(self._badmap is not None) and (self._badmap["rescued"] == size),
+			"hashes":		hashes,
+			"created_utc":	datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+		}
+		with open(destination_dir + "/manifest.json", "w") as f:
+			json.dump(self._manifest, f, indent = 4, sort_keys = True)
+		self.write_status()
 
 	def _rip_dvd(self, destination_dir):
 		self._state = "ripping"
@@ -156,8 +359,10 @@ class RipCore():
 
 		return self._rip_data_cd(destination_dir, image_filename = "dvd.iso")
 
-	def _rip_audio_track(self, track_no, destination_dir):
-		if track_no is not None:
+	def _rip_audio_track(self, track_no, destination_dir, to_stdout = False, first_track = 1):
+		if to_stdout:
+			output_filename = "-"
+		elif track_no is not None:
 			output_filename = "%s/audio_%02d.wav" % (destination_dir, track_no)
 		else:
 			# Rip whole CD
@@ -175,93 +380,488 @@ class RipCore():
 			cmd += [ "--force-cdrom-device=%s" % (self._drive.device) ]
 			cmd += [ "--log-summary=%s" % (log_summary_file) ]
 			cmd += [ "--log-debug=%s" % (log_debug_file) ]
-			if self._args.fast_rip:
+			if self._args.fast_rip or self._args.verify:
 				cmd += [ "--disable-paranoia", "--disable-extra-paranoia" ]
-#			cmd += [ "--force-read-speed", "2" ]
-#			cmd += [ "--force-read-speed", "1" ]
-#			cmd += [ "--force-read-speed", "1", "-Y" ]
-#			cmd += [ "--force-read-speed", "1", "-Y", "-Z" ]
 			cmd += [ str(track_no), output_filename ]
 		elif self._args.audiorip == "cdda2wav":
 			cmd = [ "cdda2wav" ]
 			cmd += [ "-D", self._drive.device ]
 			cmd += [ "-l", "128" ]
-			if not self._args.fast_rip:
+			if not (self._args.fast_rip or self._args.verify):
 				cmd += [ "-paranoia" ]
 			if track_no is not None:
 				cmd += [ "track=%d" % (track_no) ]
 			else:
 				# Batch mode, rip whole CD
 				cmd += [ "-B" ]
+				if first_track > 1:
+					cmd += [ "-t", "%d+%d" % (first_track, len(self._drive.media_id["tracks"]["content"])) ]
 			cmd += [ output_filename ]
 		else:
 			raise NotImplementedError(self._args.audiorip)
 		return cmd
 
+	def _rip_audio_disc(self, output_filename, track_count):
+		# All tracks in one sequential read, without seeking in between
+		if self._args.audiorip == "cdparanoia":
+			cmd = [ "cdparanoia" ]
+			cmd += [ "--force-cdrom-device=%s" % (self._drive.device) ]
+			if self._args.fast_rip or self._args.verify:
+				cmd += [ "--disable-paranoia", "--disable-extra-paranoia" ]
+			cmd += [ "1-%d" % (track_count), output_filename ]
+		elif self._args.audiorip == "cdda2wav":
+			cmd = [ "cdda2wav" ]
+			cmd += [ "-D", self._drive.device ]
+			cmd += [ "-l", "128" ]
+			if not (self._args.fast_rip or self._args.verify):
+				cmd += [ "-paranoia" ]
+			cmd += [ "-t", "1+%d" % (track_count) ]
+			cmd += [ output_filename ]
+		else:
+			raise NotImplementedError(self._args.audiorip)
+		return cmd
+
+	def _encode_audio_track(self, track_no, destination_dir):
+		return [ "flac", "--silent", "--force", "-o", "%s/audio_%02d.flac" % (destination_dir, track_no), "-" ]
+
+	def _track_checksum(self, track_no, tracks):
+		# Imported here so that numpy is only required when checksumming
+		from AccurateRip import TrackChecksum
+
+		checksum = TrackChecksum(tracks[track_no - 1]["length"] * TrackChecksum.SAMPLES_PER_SECTOR, first_track = (track_no == 1), last_track = (track_no == len(tracks)))
+		self._checksums[track_no] = checksum
+		return checksum
+
+	@staticmethod
+	def _cdparanoia_position(track_no, offset):
+		# Sector offset within a track in cdparanoia's span syntax
+		return "%d[%d:%02d.%02d]" % (track_no, offset // (60 * 75), offset // 75 % 60, offset % 75)
+
+	def _read_audio_span(self, track_no, first_sector, last_sector, output_filename, paranoia, speed = None, stderr_progress = False):
+		cmd = [ "cdparanoia" ]
+		cmd += [ "--force-cdrom-device=%s" % (self._drive.device) ]
+		if not paranoia:
+			cmd += [ "--disable-paranoia", "--disable-extra-paranoia" ]
+		if speed is not None:
+			cmd += [ "--force-read-speed", str(speed) ]
+		if stderr_progress:
+			cmd += [ "--stderr-progress" ]
+		cmd += [ "%s-%s" % (self._cdparanoia_position(track_no, first_sector), self._cdparanoia_position(track_no, last_sector)) ]
+		cmd += [ output_filename ]
+		return cmd
+
+	def _reread_audio_span(self, track_no, first_sector, last_sector, output_filename, paranoia):
+		# Verification must read with the same tool as the first pass, the
+		# tools do not necessarily agree on where a track starts
+		if self._args.audiorip == "cdparanoia":
+			return self._read_audio_span(track_no, first_sector, last_sector, output_filename, paranoia = paranoia)
+		elif self._args.audiorip == "cdda2wav":
+			cmd = [ "cdda2wav" ]
+			cmd += [ "-D", self._drive.device ]
+			if paranoia:
+				cmd += [ "-paranoia" ]
+			cmd += [ "-t", str(track_no) ]
+			cmd += [ "-o", str(first_sector) ]
+			cmd += [ "-d", "%df" % (last_sector - first_sector + 1) ]
+			cmd += [ output_filename ]
+			return cmd
+		else:
+			raise NotImplementedError(self._args.audiorip)
+
+	def _verify_windows(self, track):
+		# Either the whole track or evenly spaced one second windows that
+		# cover the requested percentage of it
+		sectors = track["length"]
+		window = 75
+		if (self._args.verify_sample >= 100) or (sectors <= window):
+			return [ (0, sectors - 1) ]
+		count = math.ceil(sectors * self._args.verify_sample / 100 / window)
+		step = (sectors - window) / max(count - 1, 1)
+		return [ (round(i * step), round(i * step) + window - 1) for i in range(count) ]
+
+	def _verify_audio_cd(self, destination_dir, tracks, track_numbers = None):
+		# Imported here so that numpy is only required in verify mode
+		from SectorCompare import SectorComparator
+
+		self._state = "verifying"
+		self._verification = {
+			"sample_percent":		self._args.verify_sample,
+			"sectors_compared":		0,
+			"mismatched_sectors":	0,
+			"repaired_ranges":		[ ],
+		}
+
+		commands = [ ]
+		comparators = [ ]
+		for (track_no, track) in enumerate(tracks, 1):
+			if (track_numbers is not None) and (track_no not in track_numbers):
+				continue
+			wav_file = "%s/audio_%02d.wav" % (destination_dir, track_no)
+			for (first_sector, last_sector) in self._verify_windows(track):
+				comparator = SectorComparator(wav_file, first_sector = first_sector, sector_count = last_sector - first_sector + 1)
+				comparators.append((track_no, comparator))
+				commands.append(self._Pipeline(source = self._reread_audio_span(track_no, first_sector, last_sector, "-", paranoia = False), sink = None, consumer = comparator.feed))
+		verify_size = sum(comparator.sector_count for (track_no, comparator) in comparators) * SectorComparator.SECTOR_SIZE
+
+		mismatches = collections.defaultdict(list)
+		def _after_verify(cid, command):
+			(track_no, comparator) = comparators[cid - 1]
+			mismatched = comparator.finish()
+			mismatches[track_no] += mismatched
+			self._verification["sectors_compared"] += comparator.sector_count
+			self._verification["mismatched_sectors"] += len(mismatched)
+			last_of_track = (cid == len(comparators)) or (comparators[cid][0] != track_no)
+			if last_of_track and (len(mismatches[track_no]) == 0):
+				# Both reads agree, nothing to repair for this track
+				self._track_completed(track_no, "audio_%02d.wav" % (track_no))
+
+		def _determine_verify_progress():
+			return sum(comparator.sectors_compared for (track_no, comparator) in comparators) * SectorComparator.SECTOR_SIZE
+
+		self._execute_cmds(commands, progress = _determine_verify_progress, disc_size = verify_size, after_command = _after_verify)
+
+		# Re-read only the ranges in which the two passes differ, this time
+		# with full paranoia, and patch them into the WAV files
+		repairs = [ ]
+		for (track_no, sectors) in sorted(mismatches.items()):
+			for (first_sector, last_sector) in SectorComparator.to_ranges(sorted(sectors), max_gap = 75):
+				repairs.append((track_no, first_sector, last_sector, "%s/repair_%02d_%06d.wav" % (destination_dir, track_no, first_sector)))
+		if len(repairs) == 0:
+			return
+
+		self._state = "repairing"
+		commands = [ self._reread_audio_span(track_no, first_sector, last_sector, repair_file, paranoia = True) for (track_no, first_sector, last_sector, repair_file) in repairs ]
+		repair_size = sum(last_sector - first_sector + 1 for (track_no, first_sector, last_sector, repair_file) in repairs) * SectorComparator.SECTOR_SIZE
+		repaired = [ 0, 0 ]
+
+		def _after_repair(cid, command):
+			(track_no, first_sector, last_sector, repair_file) = repairs[cid - 1]
+			length = (last_sector - first_sector + 1) * SectorComparator.SECTOR_SIZE
+			with open(repair_file, "rb") as f:
+				f.seek(WavTools.HEADER_SIZE)
+				data = f.read(length)
+			if len(data) != length:
+				raise Exception("Repair of track %d sectors %d-%d returned only %d of %d bytes." % (track_no, first_sector, last_sector, len(data), length))
+			with open("%s/audio_%02d.wav" % (destination_dir, track_no), "r+b") as f:
+				f.seek(WavTools.HEADER_SIZE + first_sector * SectorComparator.SECTOR_SIZE)
+				f.write(data)
+			os.unlink(repair_file)
+			repaired[0] += 1
+			repaired[1] += length
+			self._verification["repaired_ranges"].append([ track_no, first_sector, last_sector ])
+			if (cid == len(repairs)) or (repairs[cid][0] != track_no):
+				if self._checksums is not None:
+					# Checksums of the first pass are void now
+					WavFollower("%s/audio_%02d.wav" % (destination_dir, track_no), self._track_checksum(track_no, tracks).feed).poll()
+				self._track_completed(track_no, "audio_%02d.wav" % (track_no))
+
+		def _determine_repair_progress():
+			(repair_count, repaired_bytes) = repaired
+			if repair_count == len(repairs):
+				return repaired_bytes
+			repair_file = repairs[repair_count][3]
+			try:
+				current = max(os.stat(repair_file).st_size - WavTools.HEADER_SIZE, 0)
+			except FileNotFoundError:
+				current = 0
+			return repaired_bytes + current
+
+		self._execute_cmds(commands, progress = _determine_repair_progress, disc_size = repair_size, after_command = _after_repair)
+
+	def _write_cuesheet(self, filename, audio_filename, tracks):
+		with open(filename, "w") as f:
+			print("FILE \"%s\" WAVE" % (audio_filename), file = f)
+			for (track_no, track) in enumerate(tracks, 1):
+				offset = track["offset"] - tracks[0]["offset"]
+				print("  TRACK %02d AUDIO" % (track_no), file = f)
+				print("    INDEX 01 %02d:%02d:%02d" % (offset // (60 * 75), offset // 75 % 60, offset % 75), file = f)
+
+	def _rip_whole_audio_disc(self, destination_dir, tracks, consumers):
+		disc_filename = "disc.wav"
+		disc_file = destination_dir + "/" + disc_filename
+		disc_size = sum(track["length_bytes"] for track in tracks)
+		track_ranges = [ ]
+		for track in tracks:
+			track_ranges.append((sum(length for (offset, length) in track_ranges), track["length_bytes"]))
+
+		if consumers[0] is not None:
+			follower = WavFollower(disc_file, TrackDemux([ length for (offset, length) in track_ranges ], consumers).feed)
+		else:
+			follower = None
+
+		def _available():
+			if follower is not None:
+				follower.poll()
+				return follower.bytes_read
+			try:
+				return max(os.stat(disc_file).st_size - WavTools.HEADER_SIZE, 0)
+			except FileNotFoundError:
+				return 0
+
+		finished = [ 0 ]
+		def _finish_tracks(available):
+			# Tracks are split off as soon as the drive has read past their end
+			while (finished[0] < len(tracks)) and (sum(track_ranges[finished[0]]) <= available):
+				track_no = finished[0] + 1
+				if self._args.whole_disc == "split":
+					(offset, length) = track_ranges[track_no - 1]
+					WavTools.extract(disc_file, WavTools.HEADER_SIZE + offset, length, "%s/audio_%02d.wav" % (destination_dir, track_no))
+					if not self._args.verify:
+						self._track_completed(track_no, "audio_%02d.wav" % (track_no))
+				finished[0] += 1
+
+		def _determine_progress():
+			available = min(_available(), disc_size)
+			_finish_tracks(available)
+			return available
+
+		output_parser = Cdda2wavOutput() if (self._args.audiorip == "cdda2wav") else None
+		self._execute_cmds([ self._rip_audio_disc(disc_file, len(tracks)) ], progress = _determine_progress, disc_size = disc_size, output_parser = output_parser)
+		_finish_tracks(_available())
+		if finished[0] < len(tracks):
+			raise Exception("Disc image contains only %d of %d tracks." % (finished[0], len(tracks)))
+
+		if self._args.whole_disc == "split":
+			os.unlink(disc_file)
+			if self._args.verify:
+				self._verify_audio_cd(destination_dir, tracks)
+			files = [ "audio_%02d.wav" % (i) for i in range(1, len(tracks) + 1) ]
+			for (track_no, filename) in enumerate(files, 1):
+				self._track_completed(track_no, filename)
+		else:
+			self._write_cuesheet(destination_dir + "/disc.cue", disc_filename, tracks)
+			self._cuesheet = "disc.cue"
+			files = [ disc_filename ]
+		return files
+
+	def _rip_audio_cd_adaptive(self, destination_dir, tracks, consumers, resumed):
+		drive_model = "%s %s" % (self._drive.drive_id["vendor"], self._drive.drive_id["model"])
+		if self._args.speed_profile is not None:
+			controller = ReadSpeedController.from_profile(self._args.speed_profile, drive_model, max_speed = self._args.max_read_speed)
+		else:
+			controller = ReadSpeedController(max_speed = self._args.max_read_speed)
+		disc_size = sum(track["length_bytes"] for track in tracks)
+
+		# Tracks are read in regions of a few seconds each, every region with
+		# the speed that the controller chose after the previous one
+		region_sectors = max(round(self._args.speed_region * 75), 1)
+		regions = [ ]
+		for (track_no, track) in enumerate(tracks, 1):
+			if track_no in resumed:
+				continue
+			for first_sector in range(0, track["length"], region_sectors):
+				regions.append((track_no, first_sector, min(first_sector + region_sectors, track["length"]) - 1))
+
+		output_parser = CdparanoiaOutput()
+		current = {
+			"wav_file":		None,
+			"t0":			None,
+			"errors":		0,
+			"skips":		0,
+			"done_bytes":	sum(tracks[track_no - 1]["length_bytes"] for track_no in resumed),
+		}
+
+		def _update_read_speed():
+			self._read_speed = {
+				"drive_model":	drive_model,
+				"current":		controller.speed,
+				"regions":		controller.history,
+			}
+
+		def _region_command(track_no, first_sector, last_sector):
+			def _build():
+				if first_sector == 0:
+					current["wav_file"] = open("%s/audio_%02d.wav" % (destination_dir, track_no), "wb")
+					current["wav_file"].write(WavTools.header(tracks[track_no - 1]["length_bytes"]))
+				wav_file = current["wav_file"]
+				consumer = consumers[track_no - 1]
+				def _consume(data):
+					wav_file.write(data)
+					if consumer is not None:
+						consumer(data)
+				current.update({ "t0": time.time(), "errors": output_parser.errors, "skips": output_parser.skips })
+				_update_read_speed()
+				return self._Pipeline(source = self._read_audio_span(track_no, first_sector, last_sector, "-", paranoia = not self._args.fast_rip, speed = controller.speed, stderr_progress = True), sink = None, consumer = _consume)
+			return _build
+
+		def _region_done(cid, command):
+			(track_no, first_sector, last_sector) = regions[cid - 1]
+			sector_count = last_sector - first_sector + 1
+			controller.region_done(first_sector = tracks[track_no - 1]["offset"] + first_sector, sector_count = sector_count, errors = output_parser.errors - current["errors"], skips = output_parser.skips - current["skips"], elapsed = time.time() - current["t0"])
+			_update_read_speed()
+			current["done_bytes"] += sector_count * 2352
+			if last_sector == tracks[track_no - 1]["length"] - 1:
+				current["wav_file"].close()
+				if not self._args.verify:
+					self._track_completed(track_no, "audio_%02d.wav" % (track_no))
+
+		def _determine_progress():
+			if (self._runner is None) or (self._runner.pump is None):
+				return current["done_bytes"]
+			return current["done_bytes"] + self._runner.pump.bytes_transferred
+
+		commands = [ _region_command(*region) for region in regions ]
+		self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size, after_command = _region_done, output_parser = output_parser)
+		if self._args.speed_profile is not None:
+			controller.save_profile(self._args.speed_profile, drive_model)
+
+		if self._args.verify:
+			self._verify_audio_cd(destination_dir, tracks, track_numbers = [ track_no for track_no in range(1, len(tracks) + 1) if track_no not in resumed ])
+		files = [ resumed.get(i, "audio_%02d.wav" % (i)) for i in range(1, len(tracks) + 1) ]
+		for (track_no, filename) in enumerate(files, 1):
+			self._track_completed(track_no, filename)
+		return files
+
+	def _resumable_tracks(self, destination_dir, tracks):
+		# Tracks of the interrupted rip whose files are still intact
+		if self._resume_state is None:
+			return { }
+		old_checksums = { entry["trackno"]: entry for entry in (self._resume_state.get("checksums") or [ ]) }
+		resumed = { }
+		for entry in self._resume_state.get("tracks_done", [ ]):
+			(track_no, filename) = (entry["trackno"], entry["file"])
+			full_filename = destination_dir + "/" + filename
+			if not os.path.isfile(full_filename):
+				continue
+			if filename.endswith(".wav") and (FileTools.get_filesize(full_filename) != WavTools.HEADER_SIZE + tracks[track_no - 1]["length_bytes"]):
+				continue
+			if self._checksums is not None:
+				if track_no in old_checksums:
+					self._resumed_checksums[track_no] = old_checksums[track_no]
+				elif filename.endswith(".wav"):
+					WavFollower(full_filename, self._checksums[track_no].feed).poll()
+			resumed[track_no] = filename
+		return resumed
+
 	def _rip_audio_cd(self, destination_dir):
 		self._state = "ripping"
-		track_count = len(self._drive.media_id["tracks"]["content"])
-		commands = [ ]
-		disc_size = 0
-		for (track_no, track) in enumerate(self._drive.media_id["tracks"]["content"], 1):
-			disc_size += track["length_bytes"]
-		commands.append(self._rip_audio_track(None, destination_dir))
+		tracks = self._drive.media_id["tracks"]["content"]
+		disc_size = sum(track["length_bytes"] for track in tracks)
+		if self._args.checksums:
+			# Checksums are computed from the PCM data while it is produced
+			self._checksums = { }
+			consumers = [ self._track_checksum(track_no, tracks).feed for track_no in range(1, len(tracks) + 1) ]
+		else:
+			consumers = [ None ] * len(tracks)
+		if self._args.whole_disc is not None:
+			return self._rip_whole_audio_disc(destination_dir, tracks, consumers)
+
+		# Tracks that an interrupted rip already finished are not read again
+		resumed = self._resumable_tracks(destination_dir, tracks)
+		if len(resumed) > 0:
+			self._resumed = { "tracks": sorted(resumed) }
+			for (track_no, filename) in sorted(resumed.items()):
+				consumers[track_no - 1] = None
+				self._track_completed(track_no, filename)
+		missing = [ track_no for track_no in range(1, len(tracks) + 1) if track_no not in resumed ]
+
+		if self._args.adaptive_speed:
+			return self._rip_audio_cd_adaptive(destination_dir, tracks, consumers, resumed)
+		if not self._args.stream_encode:
+			if len(missing) > 0:
+				commands = [ self._rip_audio_track(None, destination_dir, first_track = missing[0]) ]
+			else:
+				commands = [ ]
+			followers = { track_no: WavFollower("%s/audio_%02d.wav" % (destination_dir, track_no), consumer) for (track_no, consumer) in enumerate(consumers, 1) if consumer is not None }
+		else:
+			# Rip each track to stdout and pipe it directly into the encoder
+			commands = [ self._Pipeline(source = self._rip_audio_track(track_no, destination_dir, to_stdout = True), sink = self._encode_audio_track(track_no, destination_dir), consumer = consumer) for (track_no, consumer) in enumerate(consumers, 1) ]
+
+		def _batch_track_done(track_no):
+			if track_no in followers:
+				followers[track_no].poll()
+			if not self._args.verify:
+				self._track_completed(track_no, "audio_%02d.wav" % (track_no))
 
 		def _determine_progress():
-			total_size = 0
-			for (track_no, track) in enumerate(self._drive.media_id["tracks"]["content"], 1):
-				wav_file = "%s/audio_%02d.wav" % (destination_dir, track_no)
-				try:
-					# Subtract size of WAV header
-					stat = os.stat(wav_file)
-					total_size += stat.st_size - 44
-				except FileNotFoundError:
-					pass
-			if total_size < 0:
-				total_size = 0
-			return total_size
+			track_no = output_parser.track
+			if track_no > len(tracks):
+				return disc_size
+			if track_no in followers:
+				followers[track_no].poll()
+			current_track = tracks[track_no - 1]["length_bytes"] * output_parser.percent // 100
+			return sum(track["length_bytes"] for track in tracks[ : track_no - 1]) + current_track
 
-		self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size)
+		def _determine_stream_progress():
+			if (self._runner is None) or (self._runner.pump is None):
+				return 0
+			track_no = self._progress["number"]
+			return sum(track["length_bytes"] for track in tracks[ : track_no - 1]) + self._runner.pump.bytes_transferred
 
-		return [ "audio_%02d.wav" % (i) for i in range(1, len(self._drive.media_id["tracks"]["content"]) + 1) ]
+		if not self._args.stream_encode:
+			output_parser = Cdda2wavOutput(first_track = missing[0] if (len(missing) > 0) else len(tracks) + 1, on_track_done = _batch_track_done)
+			self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size, output_parser = output_parser)
+			for follower in followers.values():
+				follower.poll()
+			if self._args.verify:
+				self._verify_audio_cd(destination_dir, tracks, track_numbers = missing)
+			files = [ resumed.get(i, "audio_%02d.wav" % (i)) for i in range(1, len(tracks) + 1) ]
+		else:
+			# Only used to recognize the progress output, the position is
+			# known exactly from the pipe
+			output_parser = Cdda2wavOutput() if (self._args.audiorip == "cdda2wav") else None
+			self._execute_cmds(commands, progress = _determine_stream_progress, disc_size = disc_size, before_command = lambda cid, command: cid not in resumed, after_command = lambda cid, command: self._track_completed(cid, "audio_%02d.flac" % (cid)), output_parser = output_parser)
+			files = [ resumed.get(i, "audio_%02d.flac" % (i)) for i in range(1, len(tracks) + 1) ]
+		for (track_no, filename) in enumerate(files, 1):
+			self._track_completed(track_no, filename)
+		return files
 
 	def _mock_rip(self, destdir):
 		self._state = "ripping"
+		tracks = self._drive.media_id["tracks"]["content"]
+		disc_size = sum(track["length_bytes"] for track in tracks)
+		if self._args.checksums:
+			self._checksums = { }
 
-		AudioGenerator().write_wav(destdir + "/audio_01.wav")
-
-		class ProgressMock():
-			def __init__(self, total_size, time_secs):
-				self._total_size = total_size
-				self._t0 = time.time()
-				self._time_secs = time_secs
-
-			@property
-			def total_size(self):
-				return self._total_size
-
-			@property
-			def time_secs(self):
-				return self._time_secs
-
-			def progress(self):
-				now = time.time()
-				tdiff = now - self._t0
-				amount_per_sec = self._total_size / self._time_secs
-				pos = round(tdiff * amount_per_sec)
-				if pos > self._total_size:
-					pos = self._total_size
-				return pos
-
-		prog_mock = ProgressMock(time_secs = 35, total_size = 123 * 1024 * 1024)
-		cmds = [
-			[ "sleep", str(prog_mock.time_secs) ],
-		]
-		self._execute_cmds(cmds, prog_mock.progress, prog_mock.total_size)
-		return [ "audio_01.wav" ]
+		# Every track is written by the synthetic audio generator, paced
+		# like a drive would be, so that postprocessing gets real data
+		generator = os.path.dirname(os.path.realpath(__file__)) + "/AudioGenerator.py"
+		commands = [ ]
+		for (track_no, track) in enumerate(tracks, 1):
+			cmd = [ sys.executable, generator, "--seed", str(self._args.mock_seed), "--content", self._args.mock_content, "--glitches", str(self._args.mock_glitches) ]
+			cmd += [ "--track", str(track_no), "--sectors", str(track["length"]) ]
+			if self._args.mock_speed > 0:
+				cmd += [ "--speed", str(self._args.mock_speed) ]
+			cmd += [ "%s/audio_%02d.wav" % (destdir, track_no) ]
+			commands.append(cmd)
+
+		generated = [ 0 ]
+
+		def _track_generated(cid, command):
+			generated[0] = cid
+			if self._checksums is not None:
+				WavFollower("%s/audio_%02d.wav" % (destdir, cid), self._track_checksum(cid, tracks).feed).poll()
+			self._track_completed(cid, "audio_%02d.wav" % (cid))
+
+		def _determine_progress():
+			track_no = generated[0] + 1
+			if track_no > len(tracks):
+				return disc_size
+			try:
+				current = max(os.stat("%s/audio_%02d.wav" % (destdir, track_no)).st_size - WavTools.HEADER_SIZE, 0)
+			except FileNotFoundError:
+				current = 0
+			return sum(track["length_bytes"] for track in tracks[ : track_no - 1]) + current
+
+		self._execute_cmds(commands, progress = _determine_progress, disc_size = disc_size, after_command = _track_generated)
+		return [ "audio_%02d.wav" % (track_no) for track_no in range(1, len(tracks) + 1) ]
+
+	def _load_resume_state(self):
+		try:
+			with open(self._args.destdir + "/state.json") as f:
+				state = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return None
+		# Never complete a partial rip with data from a different disc
+		current_medium = json.loads(json.dumps({ "type": self._drive.media_type.name, "info": self._drive.media_id }))
+		if (state["medium"]["type"] != current_medium["type"]) or (state["medium"]["info"] != current_medium["info"]):
+			raise Exception("Medium in drive differs from the one of the interrupted rip in %s, refusing to resume." % (self._args.destdir))
+		return state
 
 	def commence(self):
-		if os.path.exists(self._args.destdir):
+		if self._args.resume and os.path.isdir(self._args.destdir):
+			self._resume_state = self._load_resume_state()
+		elif os.path.exists(self._args.destdir):
 			if self._args.force:
 				try:
 					shutil.rmtree(self._args.destdir)
@@ -273,9 +873,10 @@ class RipCore():
 					pass
 			else:
 				raise Exception("Destination already exists, refusing to continue: %s" % (self._args.destdir))
-		os.makedirs(self._args.destdir)
+		os.makedirs(self._args.destdir, exist_ok = True)
 
 		self.write_status()
+		self._drive.write_probe_info(self._args.destdir + "/probe.json")
 		if self._args.mock is not None:
 			self._files = self._mock_rip(self._args.destdir)
 		else:
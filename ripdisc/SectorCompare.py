@@ -0,0 +1,85 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import numpy
+from Tools import WavTools
+
+# Compares streamed PCM data sector by sector against a ripped WAV file
+class SectorComparator():
+	SECTOR_SIZE = 2352
+
+	def __init__(self, wav_filename, first_sector = 0, sector_count = None):
+		# 2352 bytes per sector are exactly 294 64-bit words, which allows
+		# us to compare whole rows of machine words instead of bytes.
+		reference = numpy.memmap(wav_filename, dtype = numpy.uint8, mode = "r", offset = WavTools.HEADER_SIZE)
+		usable = len(reference) // self.SECTOR_SIZE * self.SECTOR_SIZE
+		self._reference = reference[:usable].view("<u8").reshape(-1, self.SECTOR_SIZE // 8)
+		self._first_sector = first_sector
+		if sector_count is None:
+			sector_count = len(self._reference) - first_sector
+		self._sector_count = sector_count
+		self._sector = first_sector
+		self._pending = b""
+		self._mismatches = [ ]
+
+	@property
+	def sector_count(self):
+		return self._sector_count
+
+	@property
+	def sectors_compared(self):
+		return self._sector - self._first_sector
+
+	def feed(self, data):
+		data = self._pending + data
+		count = len(data) // self.SECTOR_SIZE
+		self._pending = data[count * self.SECTOR_SIZE : ]
+		if count == 0:
+			return
+		chunk = numpy.frombuffer(data, dtype = "<u8", count = count * self.SECTOR_SIZE // 8).reshape(-1, self.SECTOR_SIZE // 8)
+		reference = self._reference[self._sector : self._sector + count]
+		differ = numpy.ones(count, dtype = bool)
+		differ[:len(reference)] = numpy.any(chunk[:len(reference)] != reference, axis = 1)
+		self._mismatches.append(numpy.flatnonzero(differ) + self._sector)
+		self._sector += count
+
+	def finish(self):
+		# Sectors that were never received count as mismatches as well
+		end_sector = self._first_sector + self._sector_count
+		if self._sector < end_sector:
+			self._mismatches.append(numpy.arange(self._sector, end_sector))
+			self._sector = end_sector
+		if len(self._mismatches) == 0:
+			return [ ]
+		return [ int(sector) for sector in numpy.concatenate(self._mismatches) ]
+
+	@staticmethod
+	def to_ranges(sectors, max_gap = 0):
+		# Inclusive (first, last) ranges; ranges closer than max_gap are
+		# joined so that scattered errors are re-read in one go
+		ranges = [ ]
+		for sector in sectors:
+			if (len(ranges) > 0) and (sector - ranges[-1][1] <= max_gap + 1):
+				ranges[-1][1] = sector
+			else:
+				ranges.append([ sector, sector ])
+		return [ tuple(entry) for entry in ranges ]
@@ -0,0 +1,396 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import time
+import random
+import bisect
+import contextlib
+
+class SimDrive():
+	_SECTOR_SIZES = {
+		"audio":	2352,
+		"data":		2048,
+		"dvd":		2048,
+	}
+
+	# Bytes per second at 1x
+	_BASE_SPEEDS = {
+		"audio":	176400,
+		"data":		153600,
+		"dvd":		1385000,
+	}
+
+	_DISC_MODES = {
+		"audio":	"CD-DA",
+		"data":		"CD-DATA (Mode 1)",
+		"dvd":		"DVD-R",
+	}
+
+	def __init__(self, device, definition):
+		self._device = device
+		self._definition = definition
+		self._bad_sectors = sorted(tuple(entry) for entry in self._definition.get("bad_sectors", [ ]))
+		self._bad_sector_starts = [ entry[0] for entry in self._bad_sectors ]
+
+	@classmethod
+	def descriptor_filename(cls, device):
+		return device + ".sim.json"
+
+	@classmethod
+	def is_simulated(cls, device):
+		return os.path.isfile(cls.descriptor_filename(device))
+
+	@classmethod
+	def load(cls, device):
+		with open(cls.descriptor_filename(device)) as f:
+			return cls(device, json.load(f))
+
+	@classmethod
+	def create(cls, device, medium, sector_count = None, track_lengths = None, **kwargs):
+		definition = {
+			"drive": {
+				"vendor":		"SimDrives",
+				"model":		"SimDVD-RW 48x",
+				"revision":		"1.00",
+			},
+			"medium":			medium,
+			"tray":				"closed",
+			"speed_curve":		[ [ 0, 16 ], [ 1, 40 ] ] if (medium != "dvd") else [ [ 0, 6 ], [ 1, 16 ] ],
+			"seek_secs":		0.08,
+			"spinup_secs":		1.0,
+			"error_secs":		0.5,
+			"clean_read_speed":	None,
+			"bad_sectors":		[ ],
+			"time_scale":		1.0,
+		}
+		definition.update(kwargs)
+		drive = cls(device, definition)
+		drive._set_medium(medium, sector_count = sector_count, track_lengths = track_lengths)
+		drive.save()
+		drive._create_image()
+		return drive
+
+	def _set_medium(self, medium, sector_count = None, track_lengths = None):
+		self._definition["medium"] = medium
+		for key in [ "tracks", "leadout", "sectors" ]:
+			self._definition.pop(key, None)
+		if medium == "audio":
+			offsets = [ 0 ]
+			for length in track_lengths:
+				offsets.append(offsets[-1] + length)
+			self._definition["tracks"] = offsets[:-1]
+			self._definition["leadout"] = offsets[-1]
+		elif medium in [ "data", "dvd" ]:
+			self._definition["sectors"] = sector_count
+			self._definition.setdefault("volume", {
+				"application":	"SIMULATED",
+				"volume":		"SIMDISC",
+			})
+
+	def _create_image(self):
+		with open(self._device, "wb") as f:
+			# Sparse image
+			f.truncate(self.sector_count * self.sector_size)
+
+	def insert(self, medium, sector_count = None, track_lengths = None):
+		# Like an operator feeding the next disc: new, flawless medium, tray closed
+		self._set_medium(medium, sector_count = sector_count, track_lengths = track_lengths)
+		self._definition["tray"] = "closed"
+		self._definition["bad_sectors"] = [ ]
+		self._definition.pop("audio", None)
+		self._bad_sectors = [ ]
+		self._bad_sector_starts = [ ]
+		self.save()
+		self._create_image()
+
+	def save(self):
+		# Replace atomically, the descriptor is read concurrently by the tools
+		# and by ripmachine
+		filename = self.descriptor_filename(self._device)
+		with open("%s.%d.tmp" % (filename, os.getpid()), "w") as f:
+			json.dump(self._definition, f, indent = 4, sort_keys = True)
+			f.write("\n")
+		os.replace("%s.%d.tmp" % (filename, os.getpid()), filename)
+
+	@property
+	def device(self):
+		return self._device
+
+	@property
+	def definition(self):
+		return self._definition
+
+	@property
+	def drive_id(self):
+		return self._definition["drive"]
+
+	@property
+	def medium(self):
+		if self.tray_open:
+			return None
+		return self._definition["medium"]
+
+	@property
+	def tray_open(self):
+		return self._definition["tray"] == "open"
+
+	@tray_open.setter
+	def tray_open(self, value):
+		self._definition["tray"] = "open" if value else "closed"
+
+	@property
+	def sector_size(self):
+		return self._SECTOR_SIZES[self._definition["medium"]]
+
+	@property
+	def base_speed(self):
+		return self._BASE_SPEEDS[self._definition["medium"]]
+
+	@property
+	def sector_count(self):
+		if self._definition["medium"] == "audio":
+			return self._definition["leadout"]
+		else:
+			return self._definition["sectors"]
+
+	@property
+	def tracks(self):
+		offsets = self._definition["tracks"] + [ self._definition["leadout"] ]
+		return [ (trackno, start, end - start) for (trackno, (start, end)) in enumerate(zip(offsets, offsets[1:]), 1) ]
+
+	def delay(self, secs):
+		time.sleep(secs * self._definition["time_scale"])
+
+	def spinup(self):
+		self.delay(self._definition["spinup_secs"])
+
+	def speed_factor(self, sector):
+		# Linear interpolation of the speed curve, which is given as a list
+		# of (disc position fraction, speed factor) tuples
+		curve = self._definition["speed_curve"]
+		position = sector / max(self.sector_count, 1)
+		for ((x0, y0), (x1, y1)) in zip(curve, curve[1:]):
+			if x0 <= position <= x1:
+				return y0 + (y1 - y0) * (position - x0) / (x1 - x0)
+		return curve[-1][1]
+
+	def bad_sector(self, sector):
+		# Returns the number of read attempts necessary to recover the
+		# sector, None for unrecoverable sectors and 0 for good sectors.
+		index = bisect.bisect_right(self._bad_sector_starts, sector) - 1
+		if index < 0:
+			return 0
+		entry = self._bad_sectors[index]
+		if sector >= entry[0] + entry[1]:
+			return 0
+		return entry[2] if (len(entry) > 2) else None
+
+	def bad_sectors_in(self, sector, count):
+		return [ sector + i for i in range(count) if self.bad_sector(sector + i) != 0 ]
+
+	def format_cd_drive(self):
+		drive_id = self.drive_id
+		return "\n".join([
+			"cd-drive version 2.0.0 x86_64-pc-linux-gnu",
+			"",
+			"CD-ROM drive supports MMC 3",
+			"",
+			"                       Drive: %s" % (self._device),
+			"Vendor                      : %s" % (drive_id["vendor"]),
+			"Model                       : %s" % (drive_id["model"]),
+			"Revision                    : %s" % (drive_id["revision"]),
+			"",
+		])
+
+	@staticmethod
+	def _msf(sector):
+		return "%02d:%02d.%02d" % (sector // 75 // 60, sector // 75 % 60, sector % 75)
+
+	def format_cdparanoia_toc(self):
+		lines = [
+			"cdparanoia III release 10.2 (September 11, 2008)",
+			"",
+			"Table of contents (audio tracks only):",
+			"track        length               begin        copy pre ch",
+			"===========================================================",
+		]
+		for (trackno, start, length) in self.tracks:
+			lines.append("%3d.  %7d [%s]  %7d [%s]    no   no  2" % (trackno, length, self._msf(length), start, self._msf(start)))
+		lines.append("TOTAL %7d [%s]    (audio only) " % (self.sector_count, self._msf(self.sector_count)))
+		lines.append("")
+		return "\n".join(lines)
+
+	def format_wodim_toc(self):
+		def track_line(trackno, lba, control, mode):
+			msf_sector = lba + 150
+			return "track:%4s lba: %9d (%9d) %02d:%02d:%02d adr: 1 control: %d mode: %d" % (trackno, lba, lba * 4, msf_sector // 75 // 60, msf_sector // 75 % 60, msf_sector % 75, control, mode)
+
+		lines = [
+			"Device was not specified. Trying to find an appropriate drive...",
+			"Using libscg version 'schily-0.9'.",
+			"Device type    : Removable CD-ROM",
+			"Vendor_info    : '%s'" % (self.drive_id["vendor"]),
+			"Identification : '%s'" % (self.drive_id["model"]),
+			"Revision       : '%s'" % (self.drive_id["revision"]),
+			"first: 1 last %d" % (len(self.tracks) if (self.medium == "audio") else 1),
+		]
+		if self.medium == "audio":
+			for (trackno, start, length) in self.tracks:
+				lines.append(track_line(str(trackno), start, 0, -1))
+		else:
+			lines.append(track_line("1", 0, 4, 1))
+		lines.append(track_line("lout", self.sector_count, 0 if (self.medium == "audio") else 4, -1))
+		lines.append("")
+		return "\n".join(lines)
+
+	def format_cdinfo(self):
+		lines = [
+			"cd-info version 2.0.0 x86_64-pc-linux-gnu",
+			"Disc mode is listed as: %s" % (self._DISC_MODES[self.medium]),
+		]
+		if self.medium in [ "data", "dvd" ]:
+			volume = self._definition["volume"]
+			lines += [
+				"CD-ROM with ISO 9660 filesystem",
+				"ISO 9660: %d blocks, label `%s'" % (self.sector_count, volume["volume"]),
+				"Application: %s" % (volume["application"]),
+				"Preparer   : ",
+				"Publisher  : ",
+				"System     : LINUX",
+				"Volume     : %s" % (volume["volume"]),
+				"Volume Set : ",
+			]
+		lines.append("")
+		return "\n".join(lines)
+
+	def probe_info(self):
+		# Raw tool output as CDMedium expects it in mock mode
+		rawinfo = {
+			"wodim":		self.format_wodim_toc(),
+			"cdinfo":		self.format_cdinfo(),
+		}
+		if self.medium == "audio":
+			rawinfo["cdparanoia"] = self.format_cdparanoia_toc()
+		else:
+			rawinfo["isoinfo"] = self.format_isoinfo()
+		return { key: value.encode("utf-8") for (key, value) in rawinfo.items() }
+
+	def format_isoinfo(self):
+		volume = self._definition["volume"]
+		return "\n".join([
+			"CD-ROM is in ISO 9660 format",
+			"System id: LINUX",
+			"Volume id: %s" % (volume["volume"]),
+			"Volume set id: ",
+			"Publisher id: ",
+			"Data preparer id: ",
+			"Application id: %s" % (volume["application"]),
+			"Logical block size is: 2048",
+			"Volume size is: %d" % (self.sector_count),
+			"",
+		])
+
+class SimReader():
+	def __init__(self, simdrive, max_speed = None):
+		self._drive = simdrive
+		self._max_speed = max_speed
+		self._position = None
+		self._retried = [ ]
+		self._bus_token = None
+		self._f = open(simdrive.device, "rb")
+
+	@property
+	def retried(self):
+		# Sectors of the last read that needed more than one attempt
+		return self._retried
+
+	def close(self):
+		self._f.close()
+		if self._bus_token is not None:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self._bus_token)
+
+	def _bus_share(self):
+		# Drives on the same simulated bus share its bandwidth, which shrinks
+		# with every additional active reader because of contention. Active
+		# readers are those that touched their token file recently.
+		bus = self._drive.definition.get("bus")
+		if bus is None:
+			return None
+		bus_dir = "%s/.simbus_%s" % (os.path.dirname(os.path.realpath(self._drive.device)), bus["name"])
+		if self._bus_token is None:
+			os.makedirs(bus_dir, exist_ok = True)
+			self._bus_token = "%s/%d" % (bus_dir, os.getpid())
+		with open(self._bus_token, "w"):
+			pass
+		now = time.time()
+		active = 0
+		for entry in os.scandir(bus_dir):
+			with contextlib.suppress(FileNotFoundError):
+				if entry.stat().st_mtime > now - 0.5:
+					active += 1
+		active = max(active, 1)
+		bandwidth = bus["bandwidth"] / (1 + bus.get("contention", 0) * (active - 1))
+		return bandwidth / active
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _pace(self, sector, count):
+		if self._position != sector:
+			self._drive.delay(self._drive.definition["seek_secs"])
+		speed = self._drive.speed_factor(sector)
+		if self._max_speed is not None:
+			speed = min(speed, self._max_speed)
+		transfer_secs = count * self._drive.sector_size / (speed * self._drive.base_speed)
+		bus_share = self._bus_share()
+		if bus_share is not None:
+			transfer_secs = max(transfer_secs, count * self._drive.sector_size / bus_share)
+		self._drive.delay(transfer_secs)
+		self._position = sector + count
+
+	def read(self, sector, count, strength = 1):
+		# Reads sectors from the image. Bad sectors cost error_secs for every
+		# read attempt; sectors that need more attempts than "strength"
+		# permits come back as garbage. Returns (data, list of bad sectors).
+		self._pace(sector, count)
+		data = bytearray(os.pread(self._f.fileno(), count * self._drive.sector_size, sector * self._drive.sector_size))
+		failed = [ ]
+		self._retried = [ ]
+		clean_read_speed = self._drive.definition.get("clean_read_speed")
+		for bad_sector in self._drive.bad_sectors_in(sector, count):
+			needed = self._drive.bad_sector(bad_sector)
+			if (needed is not None) and (clean_read_speed is not None) and (self._max_speed is not None) and (self._max_speed <= clean_read_speed):
+				# Slow enough to get past the scratch on the first attempt
+				continue
+			self._retried.append(bad_sector)
+			self._drive.delay(self._drive.definition["error_secs"] * (strength if (needed is None) else min(needed, strength)))
+			if (needed is None) or (needed > strength):
+				offset = (bad_sector - sector) * self._drive.sector_size
+				data[offset : offset + self._drive.sector_size] = random.getrandbits(8 * self._drive.sector_size).to_bytes(self._drive.sector_size, "little")
+				failed.append(bad_sector)
+		return (bytes(data), failed)
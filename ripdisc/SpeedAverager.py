@@ -24,31 +24,48 @@
 #       File UUID 02f67c57-2598-484c-bf5c-366b81471e8e
 
 import time
+import math
+import collections
 
 class SpeedAverager(object):
-	def __init__(self, min_secs = 1, average_secs = 25):
+	def __init__(self, min_secs = 1, average_secs = 25, ewma_secs = None):
 		self._min_secs = min_secs
 		self._average_secs = average_secs
-		self._pos = [ ]
+		self._ewma_secs = ewma_secs
+		self._ewma_speed = None
+		self._pos = collections.deque()
+
+	def _update_ewma(self, now, pos):
+		(t_prev, pos_prev) = self._pos[-1]
+		tdiff = now - t_prev
+		if tdiff < 1e-3:
+			return
+		speed = (pos - pos_prev) / tdiff
+		if self._ewma_speed is None:
+			self._ewma_speed = speed
+		else:
+			# Time-weighted smoothing factor so that irregular sampling
+			# intervals do not skew the average
+			alpha = 1 - math.exp(-tdiff / self._ewma_secs)
+			self._ewma_speed += alpha * (speed - self._ewma_speed)
 
 	def add(self, pos):
 		now = time.time()
 		if (len(self._pos) < 2) or (now > self._pos[-1][0] + self._min_secs):
-			self._pos.append((time.time(), pos))
+			if (self._ewma_secs is not None) and (len(self._pos) > 0):
+				self._update_ewma(now, pos)
+			self._pos.append((now, pos))
+			self._cleanup()
 
 	def _cleanup(self):
 		min_time = time.time() - self._average_secs
-		remove_index = None
-		for (index, (t, pos)) in enumerate(self._pos):
-			if t < min_time:
-				remove_index = index
-			else:
-				break
-		if remove_index is not None:
-			self._pos = self._pos[remove_index + 1 : ]
+		while (len(self._pos) > 0) and (self._pos[0][0] < min_time):
+			self._pos.popleft()
 
 	@property
 	def real_speed(self):
+		if self._ewma_secs is not None:
+			return self._ewma_speed
 		self._cleanup()
 		if len(self._pos) == 0:
 			return None
@@ -64,6 +81,12 @@ class SpeedAverager(object):
 	def speed(self):
 		return self.real_speed or 0
 
+	def eta(self, remaining):
+		speed = self.real_speed
+		if (speed is None) or (speed <= 0):
+			return None
+		return max(remaining, 0) / speed
+
 if __name__ == "__main__":
 	sa = SpeedAverager()
 	for q in range(250):
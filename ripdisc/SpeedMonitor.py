@@ -19,20 +19,75 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+
 import time
+import array
+import bisect
 
 class SpeedMonitor():
-	def __init__(self):
+	def __init__(self, max_points = 1024):
+		assert(max_points >= 16)
 		self._t0 = None
-		self._points = [ ]
+		self._max_points = max_points
+		self._times = array.array("d")
+		self._values = array.array("q")
 
 	@property
 	def data(self):
-		return self._points
+		return list(zip(self._times, self._values))
+
+	@property
+	def max_points(self):
+		return self._max_points
+
+	@staticmethod
+	def _lttb(times, values, threshold):
+		# Largest-Triangle-Three-Buckets downsampling. Keeps first and last
+		# point and within each bucket picks the point that spans the largest
+		# triangle with its neighbors, which preserves the visual shape.
+		# Buckets are of equal duration, not of equal point count, so that
+		# the result has uniform resolution over time.
+		point_count = len(times)
+		if point_count <= threshold:
+			return (times, values)
+		bucket_secs = (times[-1] - times[0]) / (threshold - 2)
+		edges = [ 1 ] + [ bisect.bisect_left(times, times[0] + i * bucket_secs, 1, point_count - 1) for i in range(1, threshold - 2) ] + [ point_count - 1 ]
+		buckets = [ (start, end) for (start, end) in zip(edges, edges[1:]) if start < end ]
+		buckets.append((point_count - 1, point_count))
+
+		result_times = array.array(times.typecode, [ times[0] ])
+		result_values = array.array(values.typecode, [ values[0] ])
+		prev = 0
+		for ((start, end), (next_start, next_end)) in zip(buckets, buckets[1:]):
+			avg_t = sum(times[next_start : next_end]) / (next_end - next_start)
+			avg_v = sum(values[next_start : next_end]) / (next_end - next_start)
+			(t0, v0) = (times[prev], values[prev])
+			max_area = -1
+			for j in range(start, end):
+				area = abs((t0 - avg_t) * (values[j] - v0) - (t0 - times[j]) * (avg_v - v0))
+				if area > max_area:
+					max_area = area
+					selected = j
+			prev = selected
+			result_times.append(times[prev])
+			result_values.append(values[prev])
+		result_times.append(times[-1])
+		result_values.append(values[-1])
+		return (result_times, result_values)
+
+	def _compact(self):
+		# Halve the resolution of everything recorded so far; new points are
+		# then recorded at full resolution until the buffer fills up again.
+		# Repeated compaction makes old data progressively coarser while the
+		# point count stays bounded.
+		(self._times, self._values) = self._lttb(self._times, self._values, self._max_points // 2)
 
 	def record(self, progress):
 		now = time.time()
 		if self._t0 is None:
 			self._t0 = now
 		tdiff = now - self._t0
-		self._points.append((tdiff, progress))
+		if len(self._times) >= self._max_points:
+			self._compact()
+		self._times.append(tdiff)
+		self._values.append(progress)
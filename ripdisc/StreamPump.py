@@ -0,0 +1,69 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+# Copies stdout of one process into stdin of another, handing the payload
+# to consumers on the way
+class StreamPump():
+	def __init__(self, source, sink, skip = 0, chunk_size = 128 * 1024):
+		self._source = source
+		self._sink = sink
+		self._skip = skip
+		self._chunk_size = chunk_size
+		self._transferred = 0
+		self._consumers = [ ]
+
+	@property
+	def bytes_transferred(self):
+		# Payload bytes, i.e., excluding the skipped header
+		return max(self._transferred - self._skip, 0)
+
+	def add_consumer(self, callback):
+		self._consumers.append(callback)
+		return self
+
+	async def run(self):
+		# False if the sink went away before the source reached EOF
+		try:
+			while True:
+				chunk = await self._source.read(self._chunk_size)
+				if len(chunk) == 0:
+					break
+				if self._sink is not None:
+					self._sink.write(chunk)
+					await self._sink.drain()
+				if self._transferred + len(chunk) > self._skip:
+					payload = chunk[max(self._skip - self._transferred, 0) : ]
+					for consumer in self._consumers:
+						consumer(payload)
+				self._transferred += len(chunk)
+			return True
+		except (BrokenPipeError, ConnectionResetError):
+			# Sink died, its exit status is reported by the caller
+			return False
+		finally:
+			if self._sink is not None:
+				self._sink.close()
+				try:
+					await self._sink.wait_closed()
+				except (BrokenPipeError, ConnectionResetError):
+					pass
@@ -20,6 +20,8 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import mmap
+import struct
 
 class FileTools():
 	@classmethod
@@ -28,3 +30,79 @@ class FileTools():
 			f.seek(0, os.SEEK_END)
 			return f.tell()
 
+class WavTools():
+	_HEADER = struct.Struct("< 4s L 4s 4s L H H L L H H 4s L")
+	HEADER_SIZE = _HEADER.size
+
+	@classmethod
+	def header(cls, pcm_length, channels = 2, samplerate = 44100, bits = 16):
+		block_align = channels * bits // 8
+		return cls._HEADER.pack(b"RIFF", 36 + pcm_length, b"WAVE", b"fmt ", 16, 1, channels, samplerate, samplerate * block_align, block_align, bits, b"data", pcm_length)
+
+	@classmethod
+	def extract(cls, src_filename, offset, length, dst_filename):
+		# copy_file_range keeps the PCM data out of userspace, a memory
+		# mapped view is the fallback
+		with open(src_filename, "rb") as src, open(dst_filename, "wb") as dst:
+			if os.fstat(src.fileno()).st_size < offset + length:
+				raise Exception("%s is too short to extract %d bytes at offset %d." % (src_filename, length, offset))
+			dst.write(cls.header(length))
+			dst.flush()
+			copied = 0
+			try:
+				while copied < length:
+					count = os.copy_file_range(src.fileno(), dst.fileno(), length - copied, offset + copied, cls.HEADER_SIZE + copied)
+					if count == 0:
+						break
+					copied += count
+			except (AttributeError, OSError):
+				pass
+			if copied < length:
+				with mmap.mmap(src.fileno(), 0, access = mmap.ACCESS_READ) as src_map, memoryview(src_map) as view:
+					dst.seek(cls.HEADER_SIZE + copied)
+					dst.write(view[offset + copied : offset + length])
+
+# Splits the PCM stream of several tracks into one stream per track
+class TrackDemux():
+	def __init__(self, track_lengths, consumers):
+		self._track_lengths = track_lengths
+		self._consumers = consumers
+		self._track = 0
+		self._remaining = track_lengths[0] if (len(track_lengths) > 0) else 0
+
+	def feed(self, data):
+		data = memoryview(data)
+		while (len(data) > 0) and (self._track < len(self._track_lengths)):
+			chunk = data[ : self._remaining]
+			self._consumers[self._track](bytes(chunk))
+			data = data[len(chunk) : ]
+			self._remaining -= len(chunk)
+			if self._remaining == 0:
+				self._track += 1
+				if self._track < len(self._track_lengths):
+					self._remaining = self._track_lengths[self._track]
+
+# Feeds the PCM data of a WAV file to a consumer while the file grows
+class WavFollower():
+	def __init__(self, filename, consumer, chunk_size = 1024 * 1024):
+		self._filename = filename
+		self._consumer = consumer
+		self._chunk_size = chunk_size
+		self._offset = WavTools.HEADER_SIZE
+
+	@property
+	def bytes_read(self):
+		return self._offset - WavTools.HEADER_SIZE
+
+	def poll(self):
+		try:
+			with open(self._filename, "rb") as f:
+				f.seek(self._offset)
+				while True:
+					chunk = f.read(self._chunk_size)
+					if len(chunk) == 0:
+						break
+					self._offset += len(chunk)
+					self._consumer(chunk)
+		except FileNotFoundError:
+			pass
@@ -22,6 +22,7 @@
 import flask
 import json
 import sys
+import os
 from ripgui.Application import app
 from ripgui.Controller import Controller
 
@@ -29,7 +30,11 @@ try:
 	import uwsgi
 except ImportError:
 	uwsgi = None
-if not uwsgi:
+if (not uwsgi) and ("RIPGUI_CONFIG" in os.environ):
+	# Served by something else than uwsgi, e.g., the load test
+	with open(os.environ["RIPGUI_CONFIG"]) as f:
+		config = json.load(f)
+elif not uwsgi:
 	print("WARNING: uwsgi module could not be loaded, no configuration is set.", file = sys.stderr)
 	config = { }
 elif "config_filename" not in uwsgi.opt:
@@ -52,7 +57,10 @@ def names():
 
 @app.route("/api/status")
 def api_status():
-	return flask.jsonify(ctrlr.ripmachine.get_status())
+	snapshot = ctrlr.ripmachine.status_snapshot()
+	response = flask.Response(snapshot.json, mimetype = "application/json")
+	response.set_etag(snapshot.status["generation"])
+	return response.make_conditional(flask.request)
 
 @app.route("/api/start/<int:drive_id>", methods = [ "POST" ])
 def api_start(drive_id):
@@ -86,6 +94,22 @@ def api_clear(drive_id):
 	ctrlr.ripmachine.clear(drive_id)
 	return api_status()
 
+@app.route("/api/jobs")
+def api_jobs():
+	return flask.jsonify(ctrlr.ripmachine.get_jobs())
+
+@app.route("/api/buses")
+def api_buses():
+	return flask.jsonify(ctrlr.ripmachine.get_buses())
+
+@app.route("/api/performance")
+def api_performance():
+	return flask.jsonify(ctrlr.ripmachine.get_performance())
+
+@app.route("/api/recommend/<media_type>")
+def api_recommend(media_type):
+	return flask.jsonify(ctrlr.ripmachine.recommend_drives(media_type))
+
 @app.route("/api/unnamed")
 def api_unnamed():
 	return flask.jsonify(ctrlr.ripmachine.get_unnamed())
@@ -104,6 +128,16 @@ def api_image(ripid):
 				"Content-Type":	"image/jpeg",
 			})
 
+@app.route("/api/checksums/<uuid:ripid>")
+def api_checksums(ripid):
+	ripid = str(ripid)
+	return flask.jsonify(ctrlr.ripmachine.get_checksums(ripid))
+
+@app.route("/api/manifest/<uuid:ripid>")
+def api_manifest(ripid):
+	ripid = str(ripid)
+	return flask.jsonify(ctrlr.ripmachine.get_manifest(ripid))
+
 @app.route("/api/setname/<uuid:ripid>", methods = [ "POST" ])
 def api_setname(ripid):
 	ripid = str(ripid)
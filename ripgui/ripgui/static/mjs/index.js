@@ -148,6 +148,29 @@ class RipDrive {
 		}
 	}
 
+	_display_badmap() {
+		const badmap_div = this._drive_div.querySelector("#badmap");
+		const badmap = this._status_data["badmap"];
+		if (!badmap) {
+			badmap_div.style.display = "none";
+			return;
+		}
+		const bin_classes = {
+			"+": "badmap-finished",
+			"?": "badmap-nontried",
+			"*": "badmap-pending",
+			"/": "badmap-pending",
+			"-": "badmap-bad",
+		};
+		badmap_div.style.display = "";
+		badmap_div.innerHTML = "";
+		for (const bin_status of badmap["overview"]) {
+			const bin = document.createElement("span");
+			bin.classList.add("badmap-bin", bin_classes[bin_status]);
+			badmap_div.append(bin);
+		}
+	}
+
 	display_status_data() {
 		if (!this._status_data || !this._drive_div) {
 			return;
@@ -161,6 +184,7 @@ class RipDrive {
 			ratio = 1;
 		}
 		this._progress.animate(ratio);
+		this._display_badmap();
 
 		const action_span = this._drive_div.querySelector("#action");
 		if (this._status_data["status"] == "idle") {
@@ -176,6 +200,13 @@ class RipDrive {
 			}
 			action_span.innerHTML += sprintf(", speed %.0f kB/s", this._status_data["speed"] / 1024);
 			action_span.innerHTML += sprintf(", %.0f MB of %.0f MB", this._status_data["progress"] / 1024 / 1024, this._status_data["data"] / 1024 / 1024);
+			if (this._status_data["eta"] != null) {
+				const eta = Math.round(this._status_data["eta"]);
+				action_span.innerHTML += sprintf(", %d:%02d remaining", eta / 60, eta % 60);
+			}
+			if ((this._status_data["badmap"] != null) && (this._status_data["badmap"]["bad"] > 0)) {
+				action_span.innerHTML += sprintf(", %.0f kB bad", this._status_data["badmap"]["bad"] / 1024);
+			}
 			this._enable_ui_buttons([ "stop" ]);
 		} else if (this._status_data["status"] == "aborted") {
 			this._set_status_icon("err");
@@ -188,6 +219,9 @@ class RipDrive {
 		} else if (this._status_data["status"] == "completed") {
 			this._set_status_icon("ok");
 			action_span.innerHTML = "completed";
+			if ((this._status_data["badmap"] != null) && (this._status_data["badmap"]["bad"] > 0)) {
+				action_span.innerHTML += sprintf(", %.0f kB unreadable", this._status_data["badmap"]["bad"] / 1024);
+			}
 			this._enable_ui_buttons([ "clear" ]);
 		} else {
 			this._set_status_icon("undefined");
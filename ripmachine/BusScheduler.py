@@ -0,0 +1,153 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import math
+import time
+
+# Drives that share bandwidth, e.g., on one USB hub. One more concurrent rip
+# is only permitted while that level is unmeasured or gave more throughput.
+class BusGroup():
+	_EWMA_SECS = 30
+	_MAX_SAMPLE_AGE_SECS = 1800
+	_MARGIN = 0.05
+
+	def __init__(self, name, drive_ids, max_concurrent = None, stagger_secs = 5, sample_secs = 15, settle_secs = 10):
+		self._name = name
+		self._drive_ids = drive_ids
+		self._max_concurrent = max_concurrent
+		self._stagger_secs = stagger_secs
+		self._sample_secs = sample_secs
+		self._settle_secs = settle_secs
+		self._last_start = None
+		self._levels = { }
+		self._last_sample = None
+		self._last_progress = None
+		self._running = None
+		self._settled = None
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def drive_ids(self):
+		return self._drive_ids
+
+	def _measured_levels(self):
+		now = time.monotonic()
+		return { concurrency: level["bytes"] / level["secs"] for (concurrency, level) in self._levels.items() if (level["sample_secs"] >= self._sample_secs) and (now - level["updated"] < self._MAX_SAMPLE_AGE_SECS) }
+
+	@property
+	def limit(self):
+		if self._max_concurrent is not None:
+			return self._max_concurrent
+		measured = self._measured_levels()
+		if len(measured) == 0:
+			return 1
+		best = 1
+		for (concurrency, throughput) in sorted(measured.items()):
+			if throughput > measured.get(best, 0) * (1 + self._MARGIN):
+				best = concurrency
+		if (best + 1 not in measured) and (best < len(self._drive_ids)):
+			# Explore the next level
+			return best + 1
+		return best
+
+	def sample(self, drive_statuses):
+		# Throughput from the progress of the rips, the speed ripdisc reports
+		# is averaged over too long a window
+		now = time.monotonic()
+		running_ids = [ drive_id for drive_id in self._drive_ids if drive_statuses[drive_id]["status"] == "running" ]
+		progress = { drive_id: (drive_statuses[drive_id]["ripid"], drive_statuses[drive_id]["progress"]) for drive_id in running_ids }
+		(last_sample, self._last_sample) = (self._last_sample, now)
+		(last_progress, self._last_progress) = (self._last_progress, progress)
+		if running_ids != self._running:
+			# Skip spinning up and identifying the medium, which would
+			# understate what the bus is capable of
+			self._running = running_ids
+			self._settled = now + self._settle_secs
+		if (last_sample is None) or (len(running_ids) == 0) or (now < self._settled):
+			return
+		if any(last_progress.get(drive_id, (None, None))[0] != progress[drive_id][0] for drive_id in running_ids):
+			return
+
+		# Time-weighted exponential average of the transferred bytes and the
+		# time it took, which is robust against progress that is reported in
+		# bursts
+		tdiff = now - last_sample
+		transferred = sum(progress[drive_id][1] - last_progress[drive_id][1] for drive_id in running_ids)
+		level = self._levels.setdefault(len(running_ids), { "bytes": 0, "secs": 0, "sample_secs": 0 })
+		decay = math.exp(-tdiff / self._EWMA_SECS)
+		level["bytes"] = level["bytes"] * decay + transferred
+		level["secs"] = level["secs"] * decay + tdiff
+		level["sample_secs"] += tdiff
+		level["updated"] = now
+
+	def may_start(self, drive_statuses):
+		if (self._last_start is not None) and (time.monotonic() - self._last_start < self._stagger_secs):
+			return False
+		running = sum(1 for drive_id in self._drive_ids if drive_statuses[drive_id]["status"] == "running")
+		return running < self.limit
+
+	def started(self):
+		self._last_start = time.monotonic()
+
+	def to_dict(self):
+		return {
+			"name":				self.name,
+			"drives":			self.drive_ids,
+			"limit":			self.limit,
+			"configured":		self._max_concurrent is not None,
+			"stagger_secs":		self._stagger_secs,
+			"throughput":		{ str(concurrency): level["bytes"] / level["secs"] for (concurrency, level) in sorted(self._levels.items()) },
+		}
+
+# Drives without a bus are not restricted
+class BusScheduler():
+	def __init__(self, config, drives):
+		self._groups = { }
+		self._group_by_drive = { }
+		for (drive_id, drive) in enumerate(drives):
+			if drive.bus is None:
+				continue
+			if drive.bus not in self._groups:
+				bus_config = config.buses.get(drive.bus, { })
+				self._groups[drive.bus] = BusGroup(drive.bus, [ ], max_concurrent = bus_config.get("max_concurrent"), stagger_secs = bus_config.get("stagger_secs", 5), sample_secs = bus_config.get("sample_secs", 15), settle_secs = bus_config.get("settle_secs", 10))
+			self._groups[drive.bus].drive_ids.append(drive_id)
+			self._group_by_drive[drive_id] = self._groups[drive.bus]
+
+	@property
+	def groups(self):
+		return iter(self._groups.values())
+
+	def sample(self, drive_statuses):
+		for group in self._groups.values():
+			group.sample(drive_statuses)
+
+	def may_start(self, drive_id, drive_statuses):
+		group = self._group_by_drive.get(drive_id)
+		return (group is None) or group.may_start(drive_statuses)
+
+	def started(self, drive_id):
+		group = self._group_by_drive.get(drive_id)
+		if group is not None:
+			group.started()
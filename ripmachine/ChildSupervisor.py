@@ -0,0 +1,85 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import select
+import threading
+
+# Reaps children the moment they exit; uses pidfds where available,
+# otherwise one waiting thread per child
+class ChildSupervisor():
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._pending = [ ]
+		self._children = { }
+		(self._wakeup_rd, self._wakeup_wr) = os.pipe()
+		self._poll = select.poll()
+		self._poll.register(self._wakeup_rd, select.POLLIN)
+		threading.Thread(target = self._run, daemon = True).start()
+
+	def watch(self, proc, callback = None):
+		try:
+			pidfd = os.pidfd_open(proc.pid)
+		except (AttributeError, OSError):
+			threading.Thread(target = self._wait, args = (proc, callback), daemon = True).start()
+			return
+		# The poll object belongs to the supervisor thread, which registers
+		# the new child when woken up
+		with self._lock:
+			self._pending.append((pidfd, proc, callback))
+		os.write(self._wakeup_wr, b"\x00")
+
+	def _notify(self, proc, callback):
+		if callback is None:
+			return
+		try:
+			callback(proc)
+		except Exception as e:
+			print("Handling exit of PID %d failed: %s: %s" % (proc.pid, e.__class__.__name__, str(e)), file = sys.stderr)
+
+	def _wait(self, proc, callback):
+		proc.wait()
+		self._notify(proc, callback)
+
+	def _register_pending(self):
+		os.read(self._wakeup_rd, 4096)
+		with self._lock:
+			(pending, self._pending) = (self._pending, [ ])
+		for (pidfd, proc, callback) in pending:
+			self._children[pidfd] = (proc, callback)
+			self._poll.register(pidfd, select.POLLIN)
+
+	def _reap(self, pidfd):
+		self._poll.unregister(pidfd)
+		os.close(pidfd)
+		(proc, callback) = self._children.pop(pidfd)
+		proc.wait()
+		self._notify(proc, callback)
+
+	def _run(self):
+		while True:
+			for (fd, event) in self._poll.poll():
+				if fd == self._wakeup_rd:
+					self._register_pending()
+				else:
+					self._reap(fd)
@@ -0,0 +1,189 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import hashlib
+import contextlib
+
+# Content-addressed store for disc images; chunk boundaries are content
+# defined so that shared regions dedupe even at different offsets
+class ChunkStore():
+	_WINDOW = 32
+
+	def __init__(self, directory, average_size = 64 * 1024, min_size = 16 * 1024, max_size = 256 * 1024, block_size = 16 * 1024 * 1024):
+		self._directory = directory
+		self._average_size = average_size
+		self._min_size = min_size
+		self._max_size = max_size
+		self._block_size = block_size
+		self._gear = None
+		for subdir in [ "chunks", "images" ]:
+			with contextlib.suppress(FileExistsError):
+				os.makedirs(self._directory + "/" + subdir)
+
+	def _chunk_filename(self, digest):
+		return "%s/chunks/%s/%s" % (self._directory, digest[:2], digest)
+
+	def _image_filename(self, name):
+		return "%s/images/%s.json" % (self._directory, name)
+
+	@staticmethod
+	def _write_atomic(filename, data):
+		tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+		with open(tmp_filename, "wb") as f:
+			f.write(data)
+		os.replace(tmp_filename, filename)
+
+	def _cut_candidates(self, block, offset):
+		# block starts with the last _WINDOW - 1 bytes before offset
+		import numpy
+		if self._gear is None:
+			# Fixed table, boundaries must never change between versions
+			self._gear = numpy.array([ int.from_bytes(hashlib.sha256(bytes([ i ])).digest()[:4], "little") for i in range(256) ], dtype = numpy.uint32)
+
+		# h[i] = sum(gear[data[i - k]] << k for k in range(32)), computed by
+		# doubling the window in five steps instead of rolling byte by byte
+		hashes = self._gear[numpy.frombuffer(block, dtype = numpy.uint8)]
+		shift = 1
+		while shift < self._WINDOW:
+			hashes = (hashes[:-shift] << numpy.uint32(shift)) + hashes[shift:]
+			shift *= 2
+		threshold = numpy.uint32((1 << 32) // self._average_size)
+		return (numpy.flatnonzero(hashes < threshold) + offset + 1).tolist()
+
+	def _chunks(self, f):
+		pending = bytearray()
+		pending_offset = 0
+		tail = bytes(self._WINDOW - 1)
+		offset = 0
+		while True:
+			block = f.read(self._block_size)
+			if len(block) == 0:
+				break
+			candidates = self._cut_candidates(tail + block, offset)
+			tail = (tail + block)[-(self._WINDOW - 1) : ]
+			pending += block
+			offset += len(block)
+
+			start = 0
+			for cut in candidates:
+				while cut - (pending_offset + start) > self._max_size:
+					yield bytes(pending[start : start + self._max_size])
+					start += self._max_size
+				if cut - (pending_offset + start) >= self._min_size:
+					yield bytes(pending[start : cut - pending_offset])
+					start = cut - pending_offset
+			# Runs without any cut candidate, e.g., zero-filled areas, must
+			# not pile up in memory until the end of the file
+			while len(pending) - start >= self._max_size:
+				yield bytes(pending[start : start + self._max_size])
+				start += self._max_size
+			del pending[ : start]
+			pending_offset += start
+
+		for start in range(0, len(pending), self._max_size):
+			yield bytes(pending[start : start + self._max_size])
+
+	def add(self, name, filename):
+		image_hash = hashlib.sha256()
+		chunks = [ ]
+		(new_chunks, new_bytes) = (0, 0)
+		with open(filename, "rb") as f:
+			for chunk in self._chunks(f):
+				image_hash.update(chunk)
+				digest = hashlib.sha256(chunk).hexdigest()
+				chunks.append([ digest, len(chunk) ])
+				chunk_filename = self._chunk_filename(digest)
+				if not os.path.exists(chunk_filename):
+					with contextlib.suppress(FileExistsError):
+						os.mkdir(os.path.dirname(chunk_filename))
+					self._write_atomic(chunk_filename, chunk)
+					new_chunks += 1
+					new_bytes += len(chunk)
+		image = {
+			"name":			name,
+			"size":			sum(size for (digest, size) in chunks),
+			"sha256":		image_hash.hexdigest(),
+			"chunks":		chunks,
+		}
+		self._write_atomic(self._image_filename(name), json.dumps(image).encode("utf-8"))
+		return {
+			"name":			name,
+			"size":			image["size"],
+			"sha256":		image["sha256"],
+			"chunks":		len(chunks),
+			"new_chunks":	new_chunks,
+			"new_bytes":	new_bytes,
+		}
+
+	def get_image(self, name):
+		with open(self._image_filename(name)) as f:
+			return json.load(f)
+
+	@property
+	def images(self):
+		return sorted(filename[:-5] for filename in os.listdir(self._directory + "/images") if filename.endswith(".json"))
+
+	def extract(self, name, filename):
+		image = self.get_image(name)
+		image_hash = hashlib.sha256()
+		with open(filename, "wb") as f:
+			for (digest, size) in image["chunks"]:
+				with open(self._chunk_filename(digest), "rb") as chunk_file:
+					chunk = chunk_file.read()
+				image_hash.update(chunk)
+				f.write(chunk)
+		if image_hash.hexdigest() != image["sha256"]:
+			raise Exception("Reconstructed image '%s' has SHA-256 %s, expected %s. Chunk store is corrupt." % (name, image_hash.hexdigest(), image["sha256"]))
+
+	def remove(self, name):
+		os.unlink(self._image_filename(name))
+
+	def _stored_chunks(self):
+		for subdir in os.listdir(self._directory + "/chunks"):
+			for digest in os.listdir(self._directory + "/chunks/" + subdir):
+				if not digest.endswith(".tmp"):
+					yield digest
+
+	def collect_garbage(self):
+		# Must not run concurrently to add()
+		referenced = set()
+		for name in self.images:
+			referenced |= set(digest for (digest, size) in self.get_image(name)["chunks"])
+		(removed_chunks, removed_bytes) = (0, 0)
+		for digest in list(self._stored_chunks()):
+			if digest not in referenced:
+				chunk_filename = self._chunk_filename(digest)
+				removed_bytes += os.stat(chunk_filename).st_size
+				os.unlink(chunk_filename)
+				removed_chunks += 1
+		return (removed_chunks, removed_bytes)
+
+	def statistics(self):
+		images = [ self.get_image(name) for name in self.images ]
+		stored = [ os.stat(self._chunk_filename(digest)).st_size for digest in self._stored_chunks() ]
+		return {
+			"images":			len(images),
+			"image_bytes":		sum(image["size"] for image in images),
+			"chunks":			len(stored),
+			"stored_bytes":		sum(stored),
+		}
@@ -0,0 +1,119 @@
+#	ripmachine - GUI-driven CD/DVD ripper
+#	Copyright (C) 2019-2019 Johannes Bauer
+#
+#	This file is part of ripmachine.
+#
+#	ripmachine is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ripmachine is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ripmachine; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import sys
+import threading
+import collections
+from .RipEnums import RipStatus, TrayStatus
+from .BusScheduler import BusScheduler
+
+# Starts a rip whenever a medium is inserted into an idle drive, in order of
+# detection as far as the bus permits, and ejects it once completed
+class JobQueue():
+	def __init__(self, rip_machine, db, config):
+		self._rip_machine = rip_machine
+		self._db = db
+		self._config = config
+		self._wakeup_event = threading.Event()
+		self._armed = set()
+		self._queued = collections.OrderedDict()
+		self._ripping = { }
+		self._scheduler = BusScheduler(config, list(rip_machine.drives))
+		threading.Thread(target = self._run, daemon = True).start()
+
+	@property
+	def busy_drives(self):
+		return set(self._queued) | set(self._ripping)
+
+	@property
+	def scheduler(self):
+		return self._scheduler
+
+	def wakeup(self):
+		self._wakeup_event.set()
+
+	def _poll_trays(self):
+		for (drive_id, drive) in enumerate(self._rip_machine.drives):
+			if (drive_id in self._queued) or (drive_id in self._ripping):
+				continue
+			if drive.status == RipStatus.Running:
+				# Started by hand, the medium is being taken care of
+				self._armed.discard(drive_id)
+				continue
+			tray_status = drive.tray_status()
+			if tray_status in [ TrayStatus.TrayOpen, TrayStatus.NoDisc ]:
+				# Only a medium that is inserted afterwards is ripped. One that
+				# was in the drive already (e.g., at startup) might be ripped.
+				self._armed.add(drive_id)
+			elif (tray_status == TrayStatus.DiscOK) and (drive_id in self._armed):
+				self._armed.discard(drive_id)
+				self._queued[drive_id] = self._db.create_job(drive.device)
+
+	def _start_queued(self, drive_statuses):
+		for (drive_id, jobid) in list(self._queued.items()):
+			drive = self._rip_machine.get_drive(drive_id)
+			if drive.status == RipStatus.Running:
+				continue
+			if not self._scheduler.may_start(drive_id, drive_statuses):
+				continue
+			del self._queued[drive_id]
+			try:
+				# A new medium supersedes the failed rip of the previous one
+				self._rip_machine.clear(drive_id)
+				rip_id = self._rip_machine.start(drive_id)
+			except Exception as e:
+				# Whatever went wrong, the job must not stay queued forever
+				print("Automatic start of drive %d failed: %s: %s" % (drive_id, e.__class__.__name__, str(e)), file = sys.stderr)
+				self._db.finish_job(jobid, "errored")
+				continue
+			self._db.start_job(jobid, rip_id)
+			self._ripping[drive_id] = jobid
+			self._scheduler.started(drive_id)
+			# Count the new rip before deciding on the next one
+			drive_statuses[drive_id] = dict(drive_statuses[drive_id], status = "running")
+
+	def _finish_ripped(self):
+		for (drive_id, jobid) in list(self._ripping.items()):
+			drive = self._rip_machine.get_drive(drive_id)
+			status = drive.status
+			if status == RipStatus.Running:
+				continue
+			del self._ripping[drive_id]
+			self._db.finish_job(jobid, status.name.lower())
+			if status == RipStatus.Completed:
+				self._rip_machine.clear(drive_id)
+				if self._config.eject_on_completion:
+					self._rip_machine.open(drive_id)
+			# Failed rips stay in the drive for the operator to look at
+
+	def _run(self):
+		while True:
+			try:
+				self._finish_ripped()
+				self._poll_trays()
+				drive_statuses = self._rip_machine.get_status()["drives"]
+				self._scheduler.sample(drive_statuses)
+				self._start_queued(list(drive_statuses))
+			except Exception as e:
+				print("Job queue: %s: %s" % (e.__class__.__name__, str(e)), file = sys.stderr)
+			self._wakeup_event.wait(self._config.autostart_interval)
+			self._wakeup_event.clear()
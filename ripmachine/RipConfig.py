@@ -28,6 +28,12 @@ class RipConfig():
 		self._config_dir = os.path.realpath(os.path.dirname(filename))
 		with open(filename) as f:
 			self._config = json.load(f)
+		if self.verify_rip and (self.whole_disc == "cue"):
+			# ripdisc would reject every single rip
+			raise Exception("The verify_rip option needs per-track WAV files and cannot be combined with whole_disc \"cue\".")
+		if self.adaptive_speed and ((self.whole_disc is not None) or (self.stream_encode and (not self.verify_rip))):
+			# Would otherwise silently be ignored
+			raise Exception("The adaptive_speed option cannot be combined with whole_disc or stream_encode.")
 
 	def _substitute(self, text):
 		text = text.replace("${configdir}", self._config_dir)
@@ -37,6 +43,10 @@ class RipConfig():
 	def drives(self):
 		return iter(self._config["drives"])
 
+	@property
+	def buses(self):
+		return self._config.get("buses", { })
+
 	def get_binary(self, name):
 		return self.get_file(self._config["binaries"][name])
 
@@ -66,14 +76,79 @@ class RipConfig():
 			os.makedirs(directory)
 		return directory
 
+	@property
+	def chunk_store_directory(self):
+		# Data images are only moved into a chunk store when one is configured
+		if "chunkstore" not in self._config["directories"]:
+			return None
+		return self.get_directory_by_name("chunkstore")
+
 	@property
 	def ripdb_filename(self):
 		return self.get_directory_by_name("work") + "/ripmachine.sqlite3"
 
+	@property
+	def postproc_wakeup_filename(self):
+		return self.get_directory_by_name("work") + "/rippostproc.fifo"
+
+	@property
+	def subprocess_env(self):
+		# When a simulated tool chain is configured, it is put in front of
+		# PATH of every child process so it shadows the real tools.
+		if "simdrive" not in self._config["binaries"]:
+			return None
+		env = dict(os.environ)
+		env["PATH"] = self.get_binary("simdrive") + ":" + env.get("PATH", "")
+		return env
+
 	@property
 	def fast_rip(self):
 		return self._config.get("options", { }).get("fast_rip", False)
 
+	@property
+	def verify_rip(self):
+		return self._config.get("options", { }).get("verify_rip", False)
+
+	@property
+	def verify_sample(self):
+		return self._config.get("options", { }).get("verify_sample", 100)
+
+	@property
+	def checksums(self):
+		return self._config.get("options", { }).get("checksums", True)
+
+	@property
+	def whole_disc(self):
+		return self._config.get("options", { }).get("whole_disc")
+
+	@property
+	def stream_encode(self):
+		return self._config.get("options", { }).get("stream_encode", False)
+
+	@property
+	def image_hashes(self):
+		return self._config.get("options", { }).get("image_hashes", [ "sha256" ])
+
+	@property
+	def adaptive_speed(self):
+		return self._config.get("options", { }).get("adaptive_speed", False)
+
+	@property
+	def status_interval(self):
+		return self._config.get("options", { }).get("status_interval", 1.0)
+
+	@property
+	def autostart(self):
+		return self._config.get("options", { }).get("autostart", False)
+
+	@property
+	def autostart_interval(self):
+		return self._config.get("options", { }).get("autostart_interval", 1.0)
+
+	@property
+	def eject_on_completion(self):
+		return self._config.get("options", { }).get("eject_on_completion", True)
+
 	@property
 	def mock_mode(self):
 		return self._config.get("options", { }).get("mock", False)
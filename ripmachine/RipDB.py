@@ -26,7 +26,7 @@ import uuid
 import threading
 
 class RipDB():
-	def __init__(self, dbfilename):
+	def __init__(self, dbfilename, reset_running = True):
 		self._conn = sqlite3.connect(dbfilename, check_same_thread = False)
 		self._cursor = self._conn.cursor()
 
@@ -43,9 +43,10 @@ class RipDB():
 			""")
 			self._conn.commit()
 
-		# If we had processes that were running previous, we consider them dead now.
-		self._cursor.execute("UPDATE rips SET end_utc = ?, status = 'rebooted' WHERE end_utc IS NULL;", (self._now(), ))
-		self._conn.commit()
+		if reset_running:
+			# If we had processes that were running previous, we consider them dead now.
+			self._cursor.execute("UPDATE rips SET end_utc = ?, status = 'rebooted' WHERE end_utc IS NULL;", (self._now(), ))
+			self._conn.commit()
 
 		with contextlib.suppress(sqlite3.OperationalError):
 			self._cursor.execute("""
@@ -65,6 +66,93 @@ class RipDB():
 			);
 			""")
 			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE probecache (
+				drive varchar NOT NULL,
+				fingerprint varchar NOT NULL,
+				media_type varchar NOT NULL,
+				rawinfo varchar NOT NULL,
+				last_seen_utc timestamp NOT NULL,
+				PRIMARY KEY (drive, fingerprint)
+			);
+			""")
+			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE checksums (
+				ripid uuid NOT NULL,
+				trackno integer NOT NULL,
+				musicbrainz_id varchar NOT NULL,
+				cddb_id varchar NOT NULL,
+				drive varchar NOT NULL,
+				crc32 varchar NOT NULL,
+				accuraterip_v1 varchar NOT NULL,
+				accuraterip_v2 varchar NOT NULL,
+				created_utc timestamp NOT NULL,
+				PRIMARY KEY (ripid, trackno)
+			);
+			""")
+			self._cursor.execute("CREATE INDEX checksums_disc ON checksums (musicbrainz_id, cddb_id, trackno);")
+			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE manifests (
+				ripid uuid NOT NULL,
+				image varchar NOT NULL,
+				size integer NOT NULL,
+				complete boolean NOT NULL,
+				algorithm varchar NOT NULL,
+				digest varchar NOT NULL,
+				created_utc timestamp NOT NULL,
+				PRIMARY KEY (ripid, image, algorithm)
+			);
+			""")
+			self._cursor.execute("CREATE INDEX manifests_digest ON manifests (algorithm, digest);")
+			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE jobs (
+				jobid uuid PRIMARY KEY,
+				drive varchar NOT NULL,
+				queued_utc timestamp NOT NULL,
+				started_utc timestamp NULL,
+				finished_utc timestamp NULL,
+				ripid uuid NULL,
+				status varchar NOT NULL
+			);
+			""")
+			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE drivestats (
+				ripid uuid PRIMARY KEY,
+				device varchar NOT NULL,
+				drive varchar NOT NULL,
+				media_type varchar NOT NULL,
+				status varchar NOT NULL,
+				disc_size integer NOT NULL,
+				read_secs real NULL,
+				avg_speed real NULL,
+				peak_speed real NULL,
+				probe_secs real NULL,
+				errors integer NOT NULL,
+				retries integer NOT NULL,
+				duration_secs real NOT NULL,
+				created_utc timestamp NOT NULL
+			);
+			""")
+			self._cursor.execute("CREATE INDEX drivestats_drive ON drivestats (drive, media_type);")
+			self._conn.commit()
+
+		if reset_running:
+			self._cursor.execute("UPDATE jobs SET finished_utc = ?, status = 'rebooted' WHERE finished_utc IS NULL;", (self._now(), ))
+			self._conn.commit()
 		self._lock = threading.Lock()
 
 	def _now(self):
@@ -102,7 +190,7 @@ class RipDB():
 				raise Exception("No such rip id")
 				return None
 			(status, imageid) = row
-			if status not in [ "aborted", "errored" ]:
+			if status not in [ "aborted", "errored", "rebooted" ]:
 				# Resume not permitted
 				raise Exception("Resume not permitted, rip status was '%s'" % (status))
 
@@ -116,6 +204,13 @@ class RipDB():
 
 			return new_ripid
 
+	def get_target_directory(self, ripid):
+		with self._lock:
+			row = self._cursor.execute("SELECT target_directory FROM rips WHERE ripid = ?;", (ripid, )).fetchone()
+			if row is None:
+				return None
+			return row[0]
+
 	def get_unnamed(self):
 		with self._lock:
 			return self._cursor.execute("""SELECT rips.ripid, rips.imageid, start_utc, status FROM rips
@@ -150,7 +245,107 @@ class RipDB():
 				""").fetchall()
 			return rows
 
+	def get_named_rips(self):
+		with self._lock:
+			rows = self._cursor.execute("""
+				SELECT rips.ripid, target_directory, status, artist, album FROM rips
+					LEFT JOIN ripmeta ON rips.ripid = ripmeta.ripid
+					WHERE ((status = 'running') OR (status = 'completed')) AND (ripmeta.ripid IS NOT NULL)
+					ORDER BY start_utc ASC;
+				""").fetchall()
+			return rows
+
 	def mark_converted(self, ripid):
 		with self._lock:
 			self._cursor.execute("UPDATE rips SET status = 'converted' WHERE (ripid = ?) AND (status = 'completed');", (ripid, ))
 			self._conn.commit()
+
+	def store_probe(self, drive, fingerprint, media_type, rawinfo):
+		with self._lock:
+			self._cursor.execute("INSERT OR REPLACE INTO probecache (drive, fingerprint, media_type, rawinfo, last_seen_utc) VALUES (?, ?, ?, ?, ?);", (drive, fingerprint, media_type, rawinfo, self._now()))
+			self._conn.commit()
+
+	def get_probes(self, drive, limit = 100):
+		with self._lock:
+			return self._cursor.execute("SELECT fingerprint, rawinfo FROM probecache WHERE (drive = ?) AND (media_type = 'AudioCD') ORDER BY last_seen_utc DESC LIMIT ?;", (drive, limit)).fetchall()
+
+	def store_checksums(self, ripid, drive, musicbrainz_id, cddb_id, checksums):
+		with self._lock:
+			now = self._now()
+			for checksum in checksums:
+				self._cursor.execute("INSERT OR REPLACE INTO checksums (ripid, trackno, musicbrainz_id, cddb_id, drive, crc32, accuraterip_v1, accuraterip_v2, created_utc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", (ripid, checksum["trackno"], musicbrainz_id, cddb_id, drive, checksum["crc32"], checksum["accuraterip_v1"], checksum["accuraterip_v2"], now))
+			self._conn.commit()
+
+	def store_manifest(self, ripid, manifest):
+		with self._lock:
+			for (algorithm, digest) in manifest["hashes"].items():
+				self._cursor.execute("INSERT OR REPLACE INTO manifests (ripid, image, size, complete, algorithm, digest, created_utc) VALUES (?, ?, ?, ?, ?, ?, ?);", (ripid, manifest["image"], manifest["size"], manifest["complete"], algorithm, digest, manifest["created_utc"]))
+			self._conn.commit()
+
+	def get_manifest(self, ripid):
+		with self._lock:
+			return self._cursor.execute("SELECT image, size, complete, algorithm, digest FROM manifests WHERE ripid = ? ORDER BY image ASC, algorithm ASC;", (ripid, )).fetchall()
+
+	def get_rips_by_digest(self, algorithm, digest):
+		with self._lock:
+			return [ row[0] for row in self._cursor.execute("SELECT ripid FROM manifests WHERE (algorithm = ?) AND (digest = ?) AND complete;", (algorithm, digest)).fetchall() ]
+
+	def get_checksums(self, ripid):
+		# For every track, count the other rips of the same disc that
+		# resulted in identical audio data
+		with self._lock:
+			return self._cursor.execute("""
+				SELECT own.trackno, own.crc32, own.accuraterip_v1, own.accuraterip_v2, COUNT(other.ripid), COUNT(DISTINCT other.drive) FROM checksums AS own
+					LEFT JOIN checksums AS other ON (other.musicbrainz_id = own.musicbrainz_id) AND (other.cddb_id = own.cddb_id) AND (other.trackno = own.trackno)
+						AND (other.ripid != own.ripid) AND ((other.accuraterip_v1 = own.accuraterip_v1) OR (other.accuraterip_v2 = own.accuraterip_v2))
+					WHERE own.ripid = ?
+					GROUP BY own.trackno
+					ORDER BY own.trackno ASC;
+				""", (ripid, )).fetchall()
+
+	def create_job(self, drive):
+		with self._lock:
+			jobid = str(uuid.uuid4())
+			self._cursor.execute("INSERT INTO jobs (jobid, drive, queued_utc, status) VALUES (?, ?, ?, 'queued');", (jobid, drive, self._now()))
+			self._conn.commit()
+			return jobid
+
+	def start_job(self, jobid, ripid):
+		with self._lock:
+			self._cursor.execute("UPDATE jobs SET started_utc = ?, ripid = ?, status = 'ripping' WHERE jobid = ?;", (self._now(), ripid, jobid))
+			self._conn.commit()
+
+	def finish_job(self, jobid, status):
+		with self._lock:
+			self._cursor.execute("UPDATE jobs SET finished_utc = ?, status = ? WHERE jobid = ?;", (self._now(), status, jobid))
+			self._conn.commit()
+
+	def get_jobs(self, limit = 100):
+		with self._lock:
+			return self._cursor.execute("SELECT jobid, drive, queued_utc, started_utc, finished_utc, ripid, status FROM jobs ORDER BY queued_utc DESC LIMIT ?;", (limit, )).fetchall()
+
+	def store_drive_stats(self, ripid, device, drive, media_type, status, stats):
+		with self._lock:
+			self._cursor.execute("INSERT OR REPLACE INTO drivestats (ripid, device, drive, media_type, status, disc_size, read_secs, avg_speed, peak_speed, probe_secs, errors, retries, duration_secs, created_utc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", (ripid, device, drive, media_type, status, stats["disc_size"], stats["read_secs"], stats["avg_speed"], stats["peak_speed"], stats["probe_secs"], stats["errors"], stats["retries"], stats["duration_secs"], self._now()))
+			self._conn.commit()
+
+	def get_drive_performance(self):
+		# Speeds and durations only of completed rips, failures only count
+		with self._lock:
+			return self._cursor.execute("""
+				SELECT drive, media_type, COUNT(*), SUM(status != 'completed'),
+					SUM(CASE WHEN (status = 'completed') AND (read_secs IS NOT NULL) THEN disc_size END) / SUM(CASE WHEN status = 'completed' THEN read_secs END),
+					MAX(CASE WHEN status = 'completed' THEN peak_speed END),
+					AVG(probe_secs),
+					AVG(CASE WHEN status = 'completed' THEN duration_secs END),
+					AVG(CASE WHEN status = 'completed' THEN disc_size END),
+					SUM(errors), SUM(retries)
+				FROM drivestats
+				GROUP BY drive, media_type
+				ORDER BY drive ASC, media_type ASC;
+			""").fetchall()
+
+	def get_drive_identities(self):
+		# Drive that was last seen at every device
+		with self._lock:
+			return dict(self._cursor.execute("SELECT device, drive FROM drivestats ORDER BY created_utc ASC;").fetchall())
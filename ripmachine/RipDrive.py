@@ -21,20 +21,30 @@
 
 import os
 import json
+import fcntl
 import subprocess
-from .RipEnums import RipStatus
+import threading
+from .RipEnums import RipStatus, TrayStatus
 
 class RipDrive():
-	def __init__(self, config, drive_config, state_change_callback):
+	_CDROM_DRIVE_STATUS = 0x5326
+	_CDSL_CURRENT = (1 << 31) - 1
+
+	def __init__(self, config, drive_config, state_change_callback, supervisor):
 		self._config = config
 		self._name = drive_config["name"]
+		self._bus = drive_config.get("bus")
 		self._dev = self._config.get_file(drive_config["dev"])
 		self._status = RipStatus.Idle
 		self._current_rip_id = None
 		self._proc = None
 		self._rip_target = None
 		self._error = None
+		self._live_status = None
+		self._status_json_cache = (None, None)
 		self._state_change_callback = state_change_callback
+		self._supervisor = supervisor
+		self._lock = threading.Lock()
 
 	@property
 	def name(self):
@@ -44,6 +54,10 @@ class RipDrive():
 	def device(self):
 		return self._dev
 
+	@property
+	def bus(self):
+		return self._bus
+
 	@property
 	def status(self):
 		return self._status
@@ -52,36 +66,74 @@ class RipDrive():
 	def rip_id(self):
 		return self._current_rip_id
 
-	def clear(self):
-		if self._status in [ RipStatus.Aborted, RipStatus.Completed, RipStatus.Errored ]:
-			self._status = RipStatus.Idle
-			self._error = None
-			self._rip_target = None
-			self._current_rip_id = None
-			return True
+	@property
+	def rip_target(self):
+		return self._rip_target
+
+	def _sim_tray_status(self):
+		# Simulated drives (see ripdisc/mksimdrive) keep their state in a
+		# descriptor next to the image
+		try:
+			with open(self._dev + ".sim.json") as f:
+				definition = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return None
+		if definition["tray"] == "open":
+			return TrayStatus.TrayOpen
+		elif definition["medium"] is None:
+			return TrayStatus.NoDisc
 		else:
-			return False
+			return TrayStatus.DiscOK
+
+	def tray_status(self):
+		# Unlike probing, this does not spin up the drive
+		sim_status = self._sim_tray_status()
+		if sim_status is not None:
+			return sim_status
+		try:
+			fd = os.open(self._dev, os.O_RDONLY | os.O_NONBLOCK)
+		except OSError:
+			return TrayStatus.NoInfo
+		try:
+			return TrayStatus(fcntl.ioctl(fd, self._CDROM_DRIVE_STATUS, self._CDSL_CURRENT))
+		except (OSError, ValueError):
+			return TrayStatus.NoInfo
+		finally:
+			os.close(fd)
+
+	def clear(self):
+		with self._lock:
+			if self._status in [ RipStatus.Aborted, RipStatus.Completed, RipStatus.Errored ]:
+				self._status = RipStatus.Idle
+				self._error = None
+				self._rip_target = None
+				self._current_rip_id = None
+				self._live_status = None
+				return True
+			else:
+				return False
 
 	def abort(self):
-		if self._proc is not None:
-			self._proc.terminate()
-			print("TERM")
-			try:
-				print("WAIT")
-				self._proc.wait(timeout = 1.0)
-				print("DONE")
-			except subprocess.TimeoutExpired:
-				print("KILL")
-				self._proc.kill()
-			try:
-				self._proc.wait(timeout = 1.0)
-			except subprocess.TimeoutExpired:
-				pass
-		self._proc = None
-		self._status = RipStatus.Aborted
-		self._state_change_callback(self, self._status)
+		with self._lock:
+			if self._proc is not None:
+				self._proc.terminate()
+				try:
+					self._proc.wait(timeout = 1.0)
+				except subprocess.TimeoutExpired:
+					self._proc.kill()
+				try:
+					self._proc.wait(timeout = 1.0)
+				except subprocess.TimeoutExpired:
+					pass
+			self._proc = None
+			self._status = RipStatus.Aborted
+			self._state_change_callback(self, self._status)
 
-	def start(self, output_directory, rip_id):
+	def start(self, output_directory, rip_id, probe_cache = None, resume = False):
+		with self._lock:
+			self._start(output_directory, rip_id, probe_cache = probe_cache, resume = resume)
+
+	def _start(self, output_directory, rip_id, probe_cache = None, resume = False):
 		if self._proc is not None:
 			raise Exception("Ripping already in progress.")
 		self._current_rip_id = rip_id
@@ -93,34 +145,86 @@ class RipDrive():
 			cmd += [ "--mock", "audio" ]
 		if self._config.fast_rip:
 			cmd += [ "--fast-rip" ]
+		if self._config.checksums:
+			cmd += [ "--checksums" ]
+		for algorithm in self._config.image_hashes:
+			cmd += [ "--image-hash", algorithm ]
+		if self._config.verify_rip:
+			cmd += [ "--verify", "--verify-sample", str(self._config.verify_sample) ]
+		if self._config.whole_disc is not None:
+			cmd += [ "--whole-disc", self._config.whole_disc ]
+		elif self._config.stream_encode and (not self._config.verify_rip):
+			cmd += [ "--stream-encode" ]
+		elif self._config.adaptive_speed:
+			cmd += [ "--adaptive-speed", "--speed-profile", self._config.get_directory_by_name("work") + "/speedprofiles.json" ]
+		if probe_cache is not None:
+			cmd += [ "--probe-cache", probe_cache ]
+		if resume:
+			cmd += [ "--resume" ]
+		(status_rd, status_wr) = os.pipe()
+		cmd += [ "--status-fd", str(status_wr) ]
 		cmd += [ self._dev, output_directory ]
-		self._proc = subprocess.Popen(cmd)
-
-	def _check_process(self):
-		if self._proc is None:
-			return
+		self._live_status = None
 		try:
-			result = self._proc.wait(timeout = 0)
+			self._proc = subprocess.Popen(cmd, pass_fds = [ status_wr ], env = self._config.subprocess_env)
+		except OSError:
+			os.close(status_rd)
+			raise
+		finally:
+			os.close(status_wr)
+		self._supervisor.watch(self._proc, self._process_exited)
+		threading.Thread(target = self._receive_status, args = (status_rd, rip_id), daemon = True).start()
+
+	def _receive_status(self, status_fd, rip_id):
+		with os.fdopen(status_fd) as f:
+			for line in f:
+				try:
+					status = json.loads(line)
+				except json.JSONDecodeError:
+					continue
+				if rip_id == self._current_rip_id:
+					self._live_status = status
+
+	def _process_exited(self, proc):
+		# Called by the supervisor as soon as ripdisc exited
+		with self._lock:
+			if proc is not self._proc:
+				# Aborted in the meantime
+				return
 			self._proc = None
-			if result == 0:
+			if proc.returncode == 0:
 				self._status = RipStatus.Completed
 			else:
 				self._status = RipStatus.Errored
-				self._error = "Process exited with status %d" % (result)
+				status = self._read_status_json()
+				if (status is not None) and (status.get("error") is not None):
+					# ripdisc knows better what went wrong
+					self._error = status["error"]
+				else:
+					self._error = "Process exited with status %d" % (proc.returncode)
 			self._state_change_callback(self, self._status)
-		except subprocess.TimeoutExpired:
-			pass
 
 	def _read_status_json(self):
 		if self._rip_target is None:
 			return None
-		self._check_process()
+		filename = self._rip_target + "/state.json"
+		try:
+			stat = os.stat(filename)
+		except FileNotFoundError:
+			return None
+		# ripdisc replaces state.json atomically, every update therefore
+		# changes inode or mtime and only then the file needs to be parsed
+		key = (filename, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+		(cached_key, cached_status) = self._status_json_cache
+		if key == cached_key:
+			return cached_status
 		try:
-			with open(self._rip_target + "/state.json") as f:
+			with open(filename) as f:
 				status = json.load(f)
-				return status
 		except (FileNotFoundError, json.JSONDecodeError):
 			return None
+		self._status_json_cache = (key, status)
+		return status
 
 	def get_status(self):
 		result = {
@@ -130,15 +234,26 @@ class RipDrive():
 			"progress":				0,
 			"data":					0,
 			"speed":				0,
+			"eta":					None,
 			"error":				self._error,
 			"track":				None,
 			"ripid":				self._current_rip_id,
+			"badmap":				None,
+			"drive_id":				None,
+			"media_type":			None,
 		}
-		status = self._read_status_json()
+		status = self._live_status
+		if status is None:
+			status = self._read_status_json()
+		if status is not None:
+			result["badmap"] = status.get("badmap")
+			result["drive_id"] = status.get("drive")
+			result["media_type"] = status.get("medium", { }).get("type")
 		if (status is not None) and ("progress" in status) and (status["progress"] is not None):
 			result["progress"] = status["progress"]["bytes_read"]
 			result["data"] = status["progress"]["disc_size"]
 			result["speed"] = status["progress"]["speed"]
+			result["eta"] = status["progress"].get("eta")
 
 			if "number" in status["progress"]:
 				result["track"] = [ status["progress"]["number"], status["progress"]["total"] ]
@@ -27,3 +27,11 @@ class RipStatus(enum.IntEnum):
 	Aborted = 2
 	Errored = 3
 	Completed = 4
+
+class TrayStatus(enum.IntEnum):
+	# Values returned by the CDROM_DRIVE_STATUS ioctl
+	NoInfo = 0
+	NoDisc = 1
+	TrayOpen = 2
+	NotReady = 3
+	DiscOK = 4
@@ -20,59 +20,257 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import json
 import enum
 import contextlib
 import uuid
 import sqlite3
 import datetime
 import subprocess
+import time
+import threading
+import collections
 from .RipDB import RipDB
 from .RipDrive import RipDrive
+from .RipEnums import RipStatus
+from .ChildSupervisor import ChildSupervisor
+from .JobQueue import JobQueue
 
 class RipMachine():
+	_StatusSnapshot = collections.namedtuple("StatusSnapshot", [ "created", "generation", "status", "json" ])
+
 	def __init__(self, config):
 		self._config = config
 		self._work_dir = self._config.get_directory_by_name("work")
 		self._db = RipDB(self._config.ripdb_filename)
-		self._drives = [ RipDrive(self._config, drive_data, self._state_change_callback) for drive_data in config.drives ]
+		self._supervisor = ChildSupervisor()
+		self._drives = [ RipDrive(self._config, drive_data, self._state_change_callback, self._supervisor) for drive_data in config.drives ]
+		self._instance_id = str(uuid.uuid4())
+		self._status_lock = threading.Lock()
+		self._status_snapshot = None
+		self._status_dirty = False
+		self._performance = None
+		if self._config.autostart:
+			self._job_queue = JobQueue(self, self._db, self._config)
+		else:
+			self._job_queue = None
 
 	def _state_change_callback(self, drive, new_state):
 		rip_id = drive.rip_id
 		self._db.finish(rip_id, new_state.name.lower())
+		self._store_probe(drive)
+		self._store_checksums(drive)
+		self._store_manifest(drive)
+		self._store_drive_stats(drive, new_state)
+		self._invalidate_status()
+		self._wakeup_postprocessor()
+		if self._job_queue is not None:
+			self._job_queue.wakeup()
+
+	def _wakeup_postprocessor(self):
+		# rippostproc listens on the FIFO; when it is not running, opening
+		# the FIFO for writing fails and there is nobody to wake up
+		try:
+			fd = os.open(self._config.postproc_wakeup_filename, os.O_WRONLY | os.O_NONBLOCK)
+		except OSError:
+			return
+		try:
+			os.write(fd, b"\n")
+		except BlockingIOError:
+			# FIFO is full, a wakeup is pending anyway
+			pass
+		finally:
+			os.close(fd)
+
+	def _store_probe(self, drive):
+		try:
+			with open(drive.rip_target + "/probe.json") as f:
+				probe = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return
+		# The TOC fingerprint only identifies audio CDs; data discs with the
+		# same sector layout would share it
+		if (probe["fingerprint"] is not None) and (probe["media_type"] == "AudioCD"):
+			self._db.store_probe(drive.device, probe["fingerprint"], probe["media_type"], json.dumps(probe["rawinfo"]))
+
+	def _store_checksums(self, drive):
+		try:
+			with open(drive.rip_target + "/state.json") as f:
+				state = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return
+		if (state["state"] != "done") or (state.get("checksums") is None):
+			return
+		ids = state["medium"]["info"]["ids"]
+		self._db.store_checksums(drive.rip_id, drive.device, ids["musicbrainz"], ids["cddb"], state["checksums"])
+
+	def _store_manifest(self, drive):
+		try:
+			with open(drive.rip_target + "/manifest.json") as f:
+				manifest = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return
+		self._db.store_manifest(drive.rip_id, manifest)
+
+	@staticmethod
+	def _drive_identity(drive_id):
+		return "%s %s %s" % (drive_id["vendor"], drive_id["model"], drive_id["revision"])
+
+	@staticmethod
+	def _rip_statistics(state):
+		graph = state.get("graph") or [ ]
+		stats = {
+			"disc_size":		state["progress"]["disc_size"] if (state.get("progress") is not None) else 0,
+			"read_secs":		None,
+			"avg_speed":		None,
+			"peak_speed":		None,
+			"probe_secs":		None,
+			"errors":			0,
+			"retries":			0,
+			"duration_secs":	state["runtime"]["now"]["unix"] - state["runtime"]["start"]["unix"],
+		}
+		if len(graph) >= 2:
+			((t0, pos0), (t1, pos1)) = (graph[0], graph[-1])
+			if t1 > t0:
+				stats["read_secs"] = t1 - t0
+				stats["avg_speed"] = (pos1 - pos0) / (t1 - t0)
+			# Peak over windows of at least two seconds, single samples are
+			# too jittery
+			(tw, posw) = graph[0]
+			for (t, pos) in graph[1:]:
+				if t - tw >= 2:
+					speed = (pos - posw) / (t - tw)
+					stats["peak_speed"] = max(stats["peak_speed"] or 0, speed)
+					(tw, posw) = (t, pos)
+			if stats["peak_speed"] is None:
+				# Rip was over too quickly for any window
+				stats["peak_speed"] = stats["avg_speed"]
+		probe_times = state["medium"].get("probe_times")
+		if probe_times:
+			# Probes run concurrently
+			stats["probe_secs"] = max(probe_times.values())
+
+		# Errors are sectors that could not be read, retries those that were
+		# read only after more than one attempt
+		if state.get("badmap") is not None:
+			stats["errors"] += state["badmap"]["bad"] // 2048
+		if state.get("read_speed") is not None:
+			for region in state["read_speed"]["regions"]:
+				stats["errors"] += region["skips"]
+				stats["retries"] += region["errors"]
+		if state.get("verification") is not None:
+			stats["retries"] += sum(last_sector - first_sector + 1 for (track_no, first_sector, last_sector) in state["verification"]["repaired_ranges"])
+		return stats
+
+	def _store_drive_stats(self, drive, new_state):
+		if new_state not in [ RipStatus.Completed, RipStatus.Errored ]:
+			return
+		try:
+			with open(drive.rip_target + "/state.json") as f:
+				state = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return
+		if (state.get("drive") is None) or (state["medium"]["type"] in [ "Unknown", "NoMedium" ]):
+			return
+		self._db.store_drive_stats(drive.rip_id, drive.device, self._drive_identity(state["drive"]), state["medium"]["type"], new_state.name.lower(), self._rip_statistics(state))
+		self._performance = None
+
+	def _write_probe_cache(self, drive_id):
+		drive = self._drives[drive_id]
+		probes = self._db.get_probes(drive.device)
+		if len(probes) == 0:
+			return None
+		filename = "%s/probecache_%d.json" % (self._work_dir, drive_id)
+		with open(filename, "w") as f:
+			json.dump({ fingerprint: json.loads(rawinfo) for (fingerprint, rawinfo) in probes }, f)
+		return filename
+
+	def _new_output_dir(self, drive_id):
+		# Drives started within the same second must not share a directory
+		return self._config.get_directory("%s/rips/%s_%d" % (self._work_dir, datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S"), drive_id))
 
 	def get_drive(self, drive_id):
 		return self._drives[drive_id]
 
 	def start(self, drive_id, image = None):
-		output_dir = self._config.get_directory("%s/rips/%s" % (self._work_dir, datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")))
+		output_dir = self._new_output_dir(drive_id)
 		rip_id = self._db.create(output_dir, image)
-		self._drives[drive_id].start(output_dir, rip_id)
+		try:
+			self._drives[drive_id].start(output_dir, rip_id, probe_cache = self._write_probe_cache(drive_id))
+		finally:
+			self._invalidate_status()
+		return rip_id
 
 	def open(self, drive_id):
-		subprocess.Popen([ "eject", self._drives[drive_id].device ])
+		self._supervisor.watch(subprocess.Popen([ "eject", self._drives[drive_id].device ], env = self._config.subprocess_env))
 
 	def close(self, drive_id):
-		subprocess.Popen([ "eject", "-t", self._drives[drive_id].device ])
+		self._supervisor.watch(subprocess.Popen([ "eject", "-t", self._drives[drive_id].device ], env = self._config.subprocess_env))
 
 	def abort(self, drive_id):
 		self._drives[drive_id].abort()
+		self._invalidate_status()
 
 	def clear(self, drive_id):
 		self._drives[drive_id].clear()
+		self._invalidate_status()
 
 	def retry(self, drive_id, failed_rip_id):
-		output_dir = self._config.get_directory("%s/rips/%s" % (self._work_dir, datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")))
+		# Continue in the directory of the failed rip so that ripdisc can
+		# reuse what was already read
+		output_dir = self._db.get_target_directory(failed_rip_id)
+		if (output_dir is None) or (not os.path.isdir(output_dir)):
+			output_dir = self._new_output_dir(drive_id)
 		rip_id = self._db.retry(output_dir, failed_rip_id)
-		self._drives[drive_id].start(output_dir, rip_id)
+		try:
+			self._drives[drive_id].start(output_dir, rip_id, probe_cache = self._write_probe_cache(drive_id), resume = True)
+		finally:
+			self._invalidate_status()
 
 	@property
 	def drives(self):
 		return iter(self._drives)
 
-	def get_status(self):
-		return {
-			"drives": [ drive.get_status() for drive in self.drives ],
+	def _invalidate_status(self):
+		with self._status_lock:
+			self._status_dirty = True
+
+	def _predict_eta(self, status):
+		# Until ripdisc has measured the speed itself, fall back to what the
+		# drive usually achieves with this kind of medium
+		if (status["status"] != "running") or (status["eta"] is not None) or (status["drive_id"] is None) or (status["data"] == 0):
+			return status
+		performance = self._get_performance().get((self._drive_identity(status["drive_id"]), status["media_type"]))
+		if (performance is None) or (performance["avg_speed"] is None):
+			return status
+		return dict(status, eta = (status["data"] - status["progress"]) / performance["avg_speed"], eta_predicted = True)
+
+	def _take_status_snapshot(self, now):
+		drives = [ self._predict_eta(drive.get_status()) for drive in self.drives ]
+		previous = self._status_snapshot
+		if (previous is not None) and (previous.status["drives"] == drives):
+			# Nothing changed, clients may keep what they have
+			return previous._replace(created = now)
+		generation = 1 if (previous is None) else (previous.generation + 1)
+		status = {
+			"generation":	"%s-%d" % (self._instance_id, generation),
+			"drives":		drives,
 		}
+		return self._StatusSnapshot(created = now, generation = generation, status = status, json = json.dumps(status))
+
+	def status_snapshot(self):
+		# All clients share one snapshot which is refreshed at most once per
+		# status interval (or after a drive was started, aborted or cleared)
+		# instead of querying every drive for every request.
+		with self._status_lock:
+			now = time.monotonic()
+			if (self._status_snapshot is None) or self._status_dirty or (now - self._status_snapshot.created >= self._config.status_interval):
+				self._status_dirty = False
+				self._status_snapshot = self._take_status_snapshot(now)
+			return self._status_snapshot
+
+	def get_status(self):
+		return self.status_snapshot().status
 
 	def get_unnamed(self):
 		return [
@@ -90,6 +288,112 @@ class RipMachine():
 
 	def set_name(self, ripid, values):
 		self._db.set_name(ripid, values)
+		self._wakeup_postprocessor()
+
+	def _get_performance(self):
+		performance = self._performance
+		if performance is None:
+			performance = { }
+			for (drive, media_type, rips, failed, avg_speed, peak_speed, probe_secs, duration_secs, disc_size, errors, retries) in self._db.get_drive_performance():
+				performance[(drive, media_type)] = {
+					"drive":			drive,
+					"media_type":		media_type,
+					"rips":				rips,
+					"failed":			failed,
+					"avg_speed":		avg_speed,
+					"peak_speed":		peak_speed,
+					"probe_secs":		probe_secs,
+					"duration_secs":	duration_secs,
+					"disc_size":		disc_size,
+					"errors":			errors,
+					"retries":			retries,
+				}
+			self._performance = performance
+		return performance
+
+	def get_performance(self):
+		return list(self._get_performance().values())
+
+	def recommend_drives(self, media_type):
+		# Free drives, fastest for this media type first and drives without
+		# any history for it last
+		performance = self._get_performance()
+		identities = self._db.get_drive_identities()
+		busy = self._job_queue.busy_drives if (self._job_queue is not None) else set()
+		candidates = [ ]
+		for (drive_id, drive) in enumerate(self._drives):
+			if (drive.status == RipStatus.Running) or (drive_id in busy):
+				continue
+			identity = identities.get(drive.device)
+			drive_performance = performance.get((identity, media_type), { })
+			candidates.append({
+				"drive_id":			drive_id,
+				"name":				drive.name,
+				"drive":			identity,
+				"avg_speed":		drive_performance.get("avg_speed"),
+				"duration_secs":	drive_performance.get("duration_secs"),
+				"rips":				drive_performance.get("rips", 0),
+			})
+		candidates.sort(key = lambda candidate: -(candidate["avg_speed"] or 0))
+		return candidates
+
+	def get_buses(self):
+		if self._job_queue is None:
+			return [ ]
+		return [ group.to_dict() for group in self._job_queue.scheduler.groups ]
+
+	def get_jobs(self):
+		def parse(timestamp):
+			if timestamp is None:
+				return None
+			return datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+
+		def secs(t0, t1):
+			if t0 is None:
+				return None
+			return ((t1 or now) - t0).total_seconds()
+
+		now = datetime.datetime.utcnow().replace(microsecond = 0)
+		jobs = [ ]
+		for (jobid, drive, queued_utc, started_utc, finished_utc, ripid, status) in self._db.get_jobs():
+			(queued, started, finished) = (parse(queued_utc), parse(started_utc), parse(finished_utc))
+			jobs.append({
+				"jobid":		jobid,
+				"drive":		drive,
+				"status":		status,
+				"ripid":		ripid,
+				"queued_utc":	queued_utc,
+				"started_utc":	started_utc,
+				"finished_utc":	finished_utc,
+				"waiting_secs":	secs(queued, started or finished),
+				"ripping_secs":	secs(started, finished),
+			})
+		return jobs
+
+	def get_manifest(self, ripid):
+		manifest = { }
+		for (image, size, complete, algorithm, digest) in self._db.get_manifest(ripid):
+			entry = manifest.setdefault(image, {
+				"size":		size,
+				"complete":	bool(complete),
+				"hashes":	{ },
+			})
+			entry["hashes"][algorithm] = digest
+			if complete:
+				entry.setdefault("duplicates", { })[algorithm] = [ other for other in self._db.get_rips_by_digest(algorithm, digest) if other != str(ripid) ]
+		return manifest
+
+	def get_checksums(self, ripid):
+		return [
+			{
+				"trackno":			item[0],
+				"crc32":			item[1],
+				"accuraterip_v1":	item[2],
+				"accuraterip_v2":	item[3],
+				"matching_rips":	item[4],
+				"matching_drives":	item[5],
+			} for item in self._db.get_checksums(ripid)
+		]
 
 if __name__ == "__main__":
 	import time
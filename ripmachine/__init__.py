@@ -22,3 +22,4 @@
 from .RipMachine import RipMachine
 from .RipConfig import RipConfig
 from .RipDB import RipDB
+from .ChunkStore import ChunkStore
@@ -20,8 +20,10 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import time
+import os
 import sys
+import stat
+import select
 import json
 import threading
 import multiprocessing
@@ -44,84 +46,257 @@ parser.add_argument("-v", "--verbose", action = "store_true", help = "Increase v
 parser.add_argument("config", metavar = "config_file", type = str, help = "Ripmachine configuration file to use")
 args = parser.parse_args(sys.argv[1:])
 
-class RipPostProcessor():
-	def __init__(self, args):
-		self._args = args
-
-		self._config = RipConfig(args.config)
-		self._jobserver = JobServer(args.processes, verbose = args.verbose)
-		self._db = RipDB(self._config.ripdb_filename)
-		self._active = set()
+class AudioConversion():
+	def __init__(self, config, jobserver, db, ripid, raw_data_dir, meta):
+		self._config = config
+		self._jobserver = jobserver
+		self._db = db
+		self._ripid = ripid
+		self._raw_data_dir = raw_data_dir
+		self._meta = meta
+		self._full_outdir = None
+		self._queued = set()
+		self._handles = [ ]
+		self._finishing = False
 
-	def _start_conversion_audio(self, ripid, raw_data_dir, state, meta):
 		output_suffix = [ ]
 		if "artist" in meta:
 			output_suffix.append(meta["artist"])
 		if "album" in meta:
 			output_suffix.append(meta["album"])
 		if len(output_suffix) > 0:
-			output_suffix = " - ".join(output_suffix)
+			self._output_suffix = " - ".join(output_suffix)
 		else:
-			output_suffix = "Unnamed"
-
-		full_outdir = self._config.get_conversion_directory(output_suffix)
+			self._output_suffix = "Unnamed"
 
-		cmds = [ ]
-		files = state.get("files")
-#		if files is None:
-		# TODO: Stupid workaround to convert existing files
-		files = [ "audio_%02d.wav" % (x) for x in range(1, len(state["medium"]["info"]["tracks"]["content"]) + 1) ]
+	@property
+	def finishing(self):
+		return self._finishing
 
-		for (trackno, infilename) in enumerate(files, 1):
-			full_infilename = raw_data_dir + "/" + infilename
-			full_outfilename = full_outdir + "/%02d %s.flac" % (trackno, output_suffix)
+	def _convert_track(self, trackno, infilename, tracktotal):
+		if self._full_outdir is None:
+			self._full_outdir = self._config.get_conversion_directory(self._output_suffix)
+		full_infilename = self._raw_data_dir + "/" + infilename
+		full_outfilename = self._full_outdir + "/%02d %s.flac" % (trackno, self._output_suffix)
+		tags = [ ]
+		if "artist" in self._meta:
+			tags.append("ARTIST=%s" % (self._meta["artist"]))
+		if "album" in self._meta:
+			tags.append("ALBUM=%s" % (self._meta["album"]))
+		tags.append("TRACKNUMBER=%d" % (trackno))
+		tags.append("TRACKTOTAL=%d" % (tracktotal))
+		if infilename.endswith(".flac"):
+			# Already encoded during the rip, only needs tagging
+			shutil.copyfile(full_infilename, full_outfilename)
+			cmd = [ "metaflac", "--remove-all-tags" ]
+			cmd += [ "--set-tag=%s" % (tag) for tag in tags ]
+			cmd += [ full_outfilename ]
+		else:
 			cmd = [ "flac" ]
-			if "artist" in meta:
-				cmd += [ "-T", "ARTIST=%s" % (meta["artist"]) ]
-			if "album" in meta:
-				cmd += [ "-T", "ALBUM=%s" % (meta["album"]) ]
-			cmd += [ "-T", "TRACKNUMBER=%d" % (trackno) ]
-			cmd += [ "-T", "TRACKTOTAL=%d" % (len(files)) ]
+			for tag in tags:
+				cmd += [ "-T", tag ]
 			cmd += [ full_infilename, "-o", full_outfilename ]
-			cmds.append(cmd)
+		self._queued.add(trackno)
+		self._handles.append(self._jobserver.run(cmd))
+
+	def _convert_disc(self, infilename, cuesheet):
+		# Whole disc image, the track layout is embedded as a cue sheet
+		if self._full_outdir is None:
+			self._full_outdir = self._config.get_conversion_directory(self._output_suffix)
+		cmd = [ "flac", "--cuesheet=%s" % (self._raw_data_dir + "/" + cuesheet) ]
+		if "artist" in self._meta:
+			cmd += [ "-T", "ARTIST=%s" % (self._meta["artist"]) ]
+		if "album" in self._meta:
+			cmd += [ "-T", "ALBUM=%s" % (self._meta["album"]) ]
+		cmd += [ self._raw_data_dir + "/" + infilename, "-o", self._full_outdir + "/%s.flac" % (self._output_suffix) ]
+		self._handles.append(self._jobserver.run(cmd))
+
+	def update(self, state, rip_completed):
+		tracktotal = len(state["medium"]["info"]["tracks"]["content"])
+		if state.get("cuesheet") is not None:
+			if rip_completed and (not self._finishing):
+				self._convert_disc(state["files"][0], state["cuesheet"])
+				self._finishing = True
+				threading.Thread(target = self._finish, daemon = True).start()
+			return
 
-		handles = self._jobserver.runall(cmds)
-		all_successful = all(handle.wait() for handle in handles)
+		if rip_completed:
+			files = state.get("files")
+			if files is None:
+				# Workaround to convert files of rips that did not record them
+				files = [ "audio_%02d.wav" % (x) for x in range(1, tracktotal + 1) ]
+			finished_tracks = list(enumerate(files, 1))
+		else:
+			finished_tracks = [ (entry["trackno"], entry["file"]) for entry in state.get("tracks_done", [ ]) ]
+
+		for (trackno, infilename) in finished_tracks:
+			if trackno not in self._queued:
+				self._convert_track(trackno, infilename, tracktotal)
+
+		if rip_completed and (not self._finishing):
+			self._finishing = True
+			threading.Thread(target = self._finish, daemon = True).start()
+
+	def _finish(self):
+		all_successful = all(handle.wait() for handle in self._handles)
 		if not all_successful:
-			print("Conversion of %s / %s failed. Not all subprocesses exited successfully." % (ripid, str(meta)))
-			shutil.rmtree(full_outdir)
+			print("Conversion of %s / %s failed. Not all subprocesses exited successfully." % (self._ripid, str(self._meta)))
+			shutil.rmtree(self._full_outdir)
+		else:
+			print("Conversion %s / %s successful." % (self._ripid, str(self._meta)))
+			self._db.mark_converted(self._ripid)
+
+	def _discard(self):
+		for handle in self._handles:
+			handle.wait()
+		if self._full_outdir is not None:
+			shutil.rmtree(self._full_outdir)
+
+	def abandon(self):
+		print("Rip %s / %s did not complete, discarding partial conversion." % (self._ripid, str(self._meta)))
+		threading.Thread(target = self._discard, daemon = True).start()
+
+class DataConversion():
+	def __init__(self, config, jobserver, db, ripid, raw_data_dir):
+		self._config = config
+		self._jobserver = jobserver
+		self._db = db
+		self._ripid = ripid
+		self._raw_data_dir = raw_data_dir
+		self._handle = None
+		self._finishing = False
+
+	@property
+	def finishing(self):
+		return self._finishing
+
+	def _read_manifest(self):
+		try:
+			with open(self._raw_data_dir + "/manifest.json") as f:
+				return json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return None
+
+	def update(self, state, rip_completed):
+		if (not rip_completed) or self._finishing:
 			return
+		manifest = self._read_manifest()
+		if manifest is not None:
+			image_filename = manifest["image"]
 		else:
-			print("Conversion %s / %s successful." % (ripid, str(meta)))
-			self._db.mark_converted(ripid)
-
-	def _start_conversion(self, ripid, raw_data_dir, meta):
-		print("Starting conversion of RIP %s raw data in %s / meta %s" % (ripid, raw_data_dir, meta))
-		with open(raw_data_dir + "/state.json") as f:
-			state = json.load(f)
-		if state["medium"]["type"] == "AudioCD":
-			threading.Thread(target = self._start_conversion_audio, args = (ripid, raw_data_dir, state, meta), daemon = True).start()
+			image_filename = "dvd.iso" if (state["medium"]["type"] == "DVD") else "image.iso"
+		cmd = [ os.path.dirname(os.path.realpath(__file__)) + "/chunkstore", "-s", self._config.chunk_store_directory, "add" ]
+		if (manifest is not None) and ("sha256" in manifest["hashes"]):
+			# Never throw away an image that does not match what was ripped;
+			# without a digest to verify against, the image is kept
+			cmd += [ "--expect-sha256", manifest["hashes"]["sha256"], "--remove-source" ]
+		cmd += [ self._ripid, self._raw_data_dir + "/" + image_filename ]
+		self._handle = self._jobserver.run(cmd)
+		self._finishing = True
+		threading.Thread(target = self._finish, daemon = True).start()
+
+	def _finish(self):
+		if not self._handle.wait():
+			print("Adding image of %s to the chunk store failed." % (self._ripid))
 		else:
-			raise NotImplementedError(state["medium"]["type"])
+			print("Image of %s added to the chunk store." % (self._ripid))
+			self._db.mark_converted(self._ripid)
+
+	def abandon(self):
+		# Nothing is started before the rip is complete
+		pass
+
+class RipPostProcessor():
+	def __init__(self, args):
+		self._args = args
+
+		self._config = RipConfig(args.config)
+		self._jobserver = JobServer(args.processes, verbose = args.verbose)
+		# Rips may still be running in ripmachine, do not mark them as rebooted
+		self._db = RipDB(self._config.ripdb_filename, reset_running = False)
+		self._active = set()
+		self._conversions = { }
+		self._wakeup_fd = self._open_wakeup_fifo(self._config.postproc_wakeup_filename)
+
+	@staticmethod
+	def _open_wakeup_fifo(filename):
+		# ripmachine writes to the FIFO when a rip has finished or was named.
+		# It is opened read-write so that it never reports EOF when there is
+		# no writer.
+		try:
+			if not stat.S_ISFIFO(os.stat(filename).st_mode):
+				os.unlink(filename)
+				os.mkfifo(filename)
+		except FileNotFoundError:
+			os.mkfifo(filename)
+		return os.open(filename, os.O_RDWR | os.O_NONBLOCK)
+
+	def _wait_for_wakeup(self, timeout):
+		(readable, _, _) = select.select([ self._wakeup_fd ], [ ], [ ], timeout)
+		if len(readable) > 0:
+			# Several notifications count as one
+			while True:
+				try:
+					if len(os.read(self._wakeup_fd, 4096)) == 0:
+						break
+				except BlockingIOError:
+					break
+
+	def _read_state(self, raw_data_dir):
+		try:
+			with open(raw_data_dir + "/state.json") as f:
+				return json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return None
+
+	def _update_conversion(self, ripid, raw_data_dir, status, meta):
+		state = self._read_state(raw_data_dir)
+		if state is None:
+			return
+		conversion = self._conversions.get(ripid)
+		if conversion is None:
+			if state["medium"]["type"] == "AudioCD":
+				print("Starting conversion of RIP %s raw data in %s / meta %s" % (ripid, raw_data_dir, meta))
+				conversion = AudioConversion(self._config, self._jobserver, self._db, ripid, raw_data_dir, meta)
+			elif (state["medium"]["type"] in [ "DataCD", "DVD" ]) and (self._config.chunk_store_directory is not None):
+				conversion = DataConversion(self._config, self._jobserver, self._db, ripid, raw_data_dir)
+			else:
+				if status == "completed":
+					print("Cannot convert RIP %s, medium type %s not supported." % (ripid, state["medium"]["type"]))
+					self._active.add(ripid)
+				return
+			self._conversions[ripid] = conversion
+
+		# Tracks are queued as soon as ripdisc reports them as finished
+		conversion.update(state, status == "completed")
+		if conversion.finishing:
+			self._active.add(ripid)
+			del self._conversions[ripid]
 
 	def _check_new_jobs(self):
-		for (ripid, target_dir, artist, album) in self._db.get_finished_rips():
+		named_rips = self._db.get_named_rips()
+		for (ripid, target_dir, status, artist, album) in named_rips:
 			if ripid not in self._active:
-				self._active.add(ripid)
 				meta = {
 					"artist":	artist,
 					"album":	album,
 				}
-				self._start_conversion(ripid, target_dir, meta)
-				if self._jobserver.busy:
-					break
+				self._update_conversion(ripid, target_dir, status, meta)
+
+		# Rips that were aborted or errored while we were converting
+		current_ripids = set(row[0] for row in named_rips)
+		for ripid in list(self._conversions):
+			if ripid not in current_ripids:
+				self._conversions.pop(ripid).abandon()
 
 	def run(self):
 		try:
 			while True:
 				if not self._jobserver.busy:
 					self._check_new_jobs()
-				time.sleep(5)
+				# Finished and named rips wake us up immediately, the timeout
+				# picks up tracks that completed during a running rip
+				self._wait_for_wakeup(5)
 		finally:
 			self._jobserver.wait()
 